@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Load and latency benchmark for wol_server.
+
+Starts the server in-process with magic packets, probes and GPIO stubbed out,
+hammers each endpoint at the requested concurrency and writes the results as
+JSON so runs can be compared to catch regressions:
+
+    python3 bench_wol_server.py --concurrency 8 --requests 2000 --output bench.json
+"""
+
+import argparse
+import http.client
+import json
+import platform
+import resource
+import statistics
+import sys
+import threading
+import time
+
+import wol_server
+
+SCENARIOS = {
+    'page': ['/'],
+    'ping': ['/ping'],
+    'wol': ['/wol'],
+    'devices': ['/devices'],
+    'metrics': ['/metrics'],
+    'pin': ['/pin/low', '/pin/high'],  # One press and release per iteration
+}
+
+class _NullSocket:
+    """Swallows magic packets instead of broadcasting them."""
+
+    def sendto(self, data, address):
+        return len(data)
+
+    def close(self):
+        pass
+
+class StubSender(wol_server.MagicPacketSender):
+    def _socket(self):
+        return _NullSocket()
+
+def _stub_probe_many(ips, *args, **kwargs):
+    return {ip: (True, 0.1, 'stub') for ip in ips}
+
+def start_server(workers):
+    """Start the server on an ephemeral port with every external effect stubbed. Returns (httpd, port)."""
+    wol_server.wol_sender = StubSender()
+    wol_server.probe_many = _stub_probe_many
+    wol_server.HW_PIN = '17'
+    wol_server.gpio = wol_server.MockGpioBackend(17)
+    # The benchmark is one client hammering one device: every action would be rate limited
+    wol_server.client_limiter.rate = wol_server.device_limiter.rate = 0
+    wol_server.load_devices()
+    wol_server.build_static_assets()
+    wol_server.monitor.start()
+    wol_server.press_engine.start()
+    # Every benchmark client connects from 127.0.0.1, so lift the per-client cap
+    httpd = wol_server.PooledHTTPServer(('127.0.0.1', 0), wol_server.RequestHandler,
+                                        max_workers=workers, max_per_client=workers * 2)
+    threading.Thread(target=httpd.serve_forever, name='bench-server', daemon=True).start()
+    return httpd, httpd.server_address[1]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+        'mean_ms': ms(statistics.mean(latencies) if latencies else None),
+    }
+
+def _request(connection, path):
+    connection.request('GET', path)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+def hammer(port, paths, total, concurrency, stop=None):
+    """Issue total requests (cycling through paths) from concurrency keep-alive clients.
+
+    With stop set, keeps going until the event is set instead. Returns (latencies, errors, elapsed).
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(total)) if stop is None else None
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local, failed = [], 0
+        while True:
+            if stop is None:
+                with lock:
+                    if next(counter, None) is None:
+                        break
+            elif stop.is_set():
+                break
+            started = time.perf_counter()
+            try:
+                for path in paths:
+                    status = _request(connection, path)
+                    # A 429 or a 503 answers fast too; only the expected answers count as served
+                    if not (200 <= status < 300 or status == 304):
+                        failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+def press_timing_under_load(port, concurrency, presses, hold):
+    """Measure how far the pin's real press duration strays from the client's while /ping is hammered.
+
+    The client sends /pin/low, waits hold seconds, then sends /pin/high; the mock
+    backend's edge timestamps give the duration the "button" actually saw. The
+    same is done with server-timed /pin/pulse for comparison.
+    """
+    stop = threading.Event()
+    load = threading.Thread(target=hammer, args=(port, ['/ping'], 0, concurrency, stop))
+    load.start()
+    try:
+        edges = wol_server.gpio.edges
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        client_errors, pulse_errors = [], []
+        for _ in range(presses):
+            edges.clear()
+            _request(connection, '/pin/low')
+            time.sleep(hold)
+            _request(connection, '/pin/high')
+            (pressed_at, _), (released_at, _) = edges[0], edges[-1]
+            client_errors.append(abs((released_at - pressed_at) / 1e9 - hold))
+
+            connection.request('GET', f'/pin/pulse?ms={hold * 1000:g}')
+            response = connection.getresponse()
+            pulse_errors.append(abs(json.loads(response.read())['error_ms']) / 1000)
+        connection.close()
+    finally:
+        stop.set()
+        load.join()
+    ms = lambda values, fraction: round(percentile(sorted(values), fraction) * 1000, 3)
+    return {
+        'presses': presses,
+        'hold_ms': hold * 1000,
+        'ping_concurrency': concurrency,
+        'client_timed_error_p50_ms': ms(client_errors, 0.50),
+        'client_timed_error_p99_ms': ms(client_errors, 0.99),
+        'server_timed_error_p50_ms': ms(pulse_errors, 0.50),
+        'server_timed_error_p99_ms': ms(pulse_errors, 0.99),
+    }
+
+def rss_kb():
+    """Current resident set size in KiB (Linux), falling back to the peak."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent keep-alive clients')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario')
+    parser.add_argument('--workers', type=int, default=wol_server.MAX_WORKERS, help='server worker threads')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset of: '
+                        + ', '.join(SCENARIOS))
+    parser.add_argument('--presses', type=int, default=20, help='presses in the timing-under-load scenario')
+    parser.add_argument('--hold-ms', type=float, default=100.0, help='press duration in that scenario')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.scenarios.split(',') if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    httpd, port = start_server(args.workers)
+    results = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'concurrency': args.concurrency,
+        'workers': args.workers,
+        'rss_start_kb': rss_kb(),
+        'scenarios': {},
+    }
+    try:
+        for name in args.scenarios.split(','):
+            # The button is one physical line: pressing it from many clients at once only measures refusals
+            concurrency = 1 if name == 'pin' else args.concurrency
+            latencies, errors, elapsed = hammer(port, SCENARIOS[name], args.requests, concurrency)
+            results['scenarios'][name] = summarize(latencies, errors, elapsed)
+            print(f"{name:>8}: {results['scenarios'][name]}", file=sys.stderr)
+        results['press_timing_under_load'] = press_timing_under_load(
+            port, args.concurrency, args.presses, args.hold_ms / 1000)
+        print(f"   press: {results['press_timing_under_load']}", file=sys.stderr)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        wol_server.monitor.stop()
+    results['rss_end_kb'] = rss_kb()
+    results['rss_peak_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
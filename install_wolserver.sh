@@ -8,6 +8,8 @@ BASE_DIR="/home/$USER"
 # GitHub raw URL for the *new* Python script
 # !!! UPDATE THIS URL to point to your hosted version of the Python script above !!!
 RAW_PYTHON_URL="https://raw.githubusercontent.com/AlviseMantelli/wol_on_http/main/wol_server.py"
+# The dashboard page template, served by the script
+RAW_PAGE_URL="https://raw.githubusercontent.com/AlviseMantelli/wol_on_http/main/wol_page.html"
 
 
 # --- Main Installation Logic ---
@@ -31,6 +33,8 @@ echo "ℹ️  Using sanitized name for resources: '$SAFE_NAME'"
 SERVICE_NAME="wolserver-$SAFE_NAME"
 SERVICE_FILE="/etc/systemd/system/${SERVICE_NAME}.service"
 TARGET_SCRIPT="$BASE_DIR/wol_server_$SAFE_NAME.py"
+TARGET_PAGE="$BASE_DIR/wol_page_$SAFE_NAME.html"
+CONFIG_FILE="$BASE_DIR/wol_config_$SAFE_NAME.json"
 VENV_DIR="$BASE_DIR/wolenv_$SAFE_NAME"
 PYTHON_BIN="$VENV_DIR/bin/python"
 PIP_BIN="$VENV_DIR/bin/pip"
@@ -46,23 +50,36 @@ PORT=""
 HW_PIN=""
 KEEP_VARS="no" # Default to 'no' for keeping variables
 
+# Print one setting from the existing config file
+read_config_value() {
+    python3 -c 'import json, sys; print(json.load(open(sys.argv[1])).get(sys.argv[2], ""))' "$CONFIG_FILE" "$1" 2>/dev/null
+}
+
 # --- Variable Retention Logic ---
-# Check if the Python script *for this specific service* already exists
-if [ -f "$TARGET_SCRIPT" ]; then
-    echo "⚠️  Existing script found at $TARGET_SCRIPT."
+# Settings live in the config file; installs from before it existed kept them in the script itself
+if [ -f "$CONFIG_FILE" ] || [ -f "$TARGET_SCRIPT" ]; then
+    echo "⚠️  Existing installation found for $SERVICE_NAME."
     read -rp "Do you want to keep the current MAC, IP, Broadcast IP, and PORT variables from it? (y/N): " KEEP_VARS_INPUT
     KEEP_VARS_INPUT=${KEEP_VARS_INPUT,,} # Convert input to lowercase
 
     if [[ "$KEEP_VARS_INPUT" == "y" || "$KEEP_VARS_INPUT" == "yes" ]]; then
         KEEP_VARS="yes"
-        echo "ℹ️  Attempting to load variables from the existing script..."
-        
-        # Read existing variables. Using 'grep' and 'awk' for robustness.
-        OLD_MAC_READ=$(grep "TARGET_MAC =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
-        OLD_IP_READ=$(grep "TARGET_IP =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
-        OLD_BROADCAST_READ=$(grep "BROADCAST_IP =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
-        OLD_PORT_READ=$(grep "PORT =" "$TARGET_SCRIPT" | awk -F"=" '{print $2}' | tr -d ' ' | head -1)
-        OLD_PIN_READ=$(grep "HW_PIN =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
+        if [ -f "$CONFIG_FILE" ]; then
+            echo "ℹ️  Attempting to load variables from $CONFIG_FILE..."
+            OLD_MAC_READ=$(read_config_value TARGET_MAC)
+            OLD_IP_READ=$(read_config_value TARGET_IP)
+            OLD_BROADCAST_READ=$(read_config_value BROADCAST_IP)
+            OLD_PORT_READ=$(read_config_value PORT)
+            OLD_PIN_READ=$(read_config_value HW_PIN)
+        else
+            echo "ℹ️  Attempting to load variables from the existing script..."
+            # Read existing variables. Using 'grep' and 'awk' for robustness.
+            OLD_MAC_READ=$(grep "^TARGET_MAC =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
+            OLD_IP_READ=$(grep "^TARGET_IP =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
+            OLD_BROADCAST_READ=$(grep "^BROADCAST_IP =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
+            OLD_PORT_READ=$(grep "^PORT =" "$TARGET_SCRIPT" | awk -F"=" '{print $2}' | tr -d ' ' | head -1)
+            OLD_PIN_READ=$(grep "^HW_PIN =" "$TARGET_SCRIPT" | awk -F"'" '{print $2}' | head -1)
+        fi
 
         # Assign read values if they are not empty
         TARGET_MAC=${OLD_MAC_READ:-$TARGET_MAC}
@@ -181,10 +198,11 @@ if [ ! -d "$VENV_DIR" ]; then
     }
 fi
 
-# Install wakeonlan inside virtualenv
-echo "📦 Installing or updating required Python package 'wakeonlan' in $VENV_DIR..."
+# Upgrade pip inside virtualenv (magic packets are built by the server itself, no package needed)
+echo "📦 Updating pip in $VENV_DIR..."
 "$PIP_BIN" install --upgrade pip || { echo "❌ Failed to upgrade pip."; exit 1; }
-"$PIP_BIN" install wakeonlan || { echo "❌ Failed to install wakeonlan."; exit 1; }
+# Optional: lets the server offer a brotli-compressed page (gzip is always available)
+"$PIP_BIN" install brotli || echo "⚠️ Failed to install brotli. The page will be served with gzip only."
 
 # Install rpi-lgpio (Bookworm compatibility layer) if a PIN is defined
 if [ -n "$HW_PIN" ]; then
@@ -207,25 +225,49 @@ curl -fsSL "$RAW_PYTHON_URL" -o "$TARGET_SCRIPT" || {
     exit 1
 }
 
-# Inject variables into the downloaded Python script
-echo "🛠️  Injecting variables into the Python script..."
-# Using single quotes for strings in Python
-sed -i "s/^TARGET_MAC = .*/TARGET_MAC = '$TARGET_MAC'/" "$TARGET_SCRIPT" || { echo "❌ Failed to update TARGET_MAC."; exit 1; }
-sed -i "s/^TARGET_IP = .*/TARGET_IP = '$TARGET_IP'/" "$TARGET_SCRIPT" || { echo "❌ Failed to update TARGET_IP."; exit 1; }
-sed -i "s/^BROADCAST_IP = .*/BROADCAST_IP = '$BROADCAST_IP'/" "$TARGET_SCRIPT" || { echo "❌ Failed to update BROADCAST_IP."; exit 1; }
-
-# Use | as delimiter for sed since FRIENDLY_NAME might contain slashes or other special chars
-sed -i "s|^FRIENDLY_NAME = .*|FRIENDLY_NAME = '$FRIENDLY_NAME'|" "$TARGET_SCRIPT" || { echo "❌ Failed to update FRIENDLY_NAME."; exit 1; }
+echo "⬇️  Downloading the page template to $TARGET_PAGE..."
+curl -fsSL "$RAW_PAGE_URL" -o "$TARGET_PAGE" || {
+    echo "❌ Failed to download the page template from $RAW_PAGE_URL."
+    exit 1
+}
 
-# PORT is an integer in Python, so no quotes
-sed -i "s/^PORT = .*/PORT = $PORT/" "$TARGET_SCRIPT" || { echo "❌ Failed to update PORT."; exit 1; }
-sed -i "s/^HW_PIN = .*/HW_PIN = '$HW_PIN'/" "$TARGET_SCRIPT" || { echo "❌ Failed to update HW_PIN."; exit 1; }
+# Write the settings to the config file, keeping any other settings already in it.
+# The running server watches this file, so later edits apply without a restart.
+echo "🛠️  Writing settings to $CONFIG_FILE..."
+TARGET_MAC="$TARGET_MAC" TARGET_IP="$TARGET_IP" BROADCAST_IP="$BROADCAST_IP" PORT="$PORT" HW_PIN="$HW_PIN" \
+FRIENDLY_NAME="$FRIENDLY_NAME" PAGE_FILE="$TARGET_PAGE" HISTORY_FILE="$BASE_DIR/wol_history_$SAFE_NAME.tsv" \
+JOBS_FILE="$BASE_DIR/wol_jobs_$SAFE_NAME.json" TARGET_ID="$SAFE_NAME" \
+python3 - "$CONFIG_FILE" <<'PYEOF' || { echo "❌ Failed to write $CONFIG_FILE."; exit 1; }
+import json, os, sys
+path = sys.argv[1]
+try:
+    with open(path) as f:
+        config = json.load(f)
+except (OSError, ValueError):
+    config = {}
+for name in ('TARGET_MAC', 'TARGET_IP', 'BROADCAST_IP', 'HW_PIN', 'FRIENDLY_NAME', 'PAGE_FILE', 'HISTORY_FILE',
+             'JOBS_FILE'):
+    config[name] = os.environ[name]
+config['PORT'] = int(os.environ['PORT'])
+# Pin the device id to the name it was installed under, so renaming it later keeps its history and jobs
+config.setdefault('TARGET_ID', os.environ['TARGET_ID'])
+# Replace the file in one step so the server never reads it half-written
+with open(path + '.tmp', 'w') as f:
+    json.dump(config, f, indent=2)
+    f.write('\n')
+os.replace(path + '.tmp', path)
+PYEOF
 
 # Set appropriate permissions and ownership for the Python script
 chmod +x "$TARGET_SCRIPT" || { echo "❌ Failed to set script executable permissions."; exit 1; }
-chown "$USER:$USER" "$TARGET_SCRIPT" || { echo "❌ Failed to set script ownership."; exit 1; }
+chown "$USER:$USER" "$TARGET_SCRIPT" "$TARGET_PAGE" "$CONFIG_FILE" || { echo "❌ Failed to set script ownership."; exit 1; }
 echo "Python script configured and permissions set."
 
+# The service runs the script as a module (python -m), which loads this bytecode instead of
+# recompiling the whole file on every start; a script run directly is always recompiled
+echo "⚙️  Precompiling the Python script..."
+sudo -u "$USER" "$PYTHON_BIN" -m py_compile "$TARGET_SCRIPT" || echo "⚠️ Failed to precompile; the first start will be slower."
+
 # --- Systemd Service Setup ---
 # Create the systemd service file
 echo "⚙️  Writing systemd service to $SERVICE_FILE..."
@@ -235,7 +277,7 @@ Description=WOL HTTP Listener for $FRIENDLY_NAME
 After=network.target
 
 [Service]
-ExecStart=$PYTHON_BIN $TARGET_SCRIPT
+ExecStart=$PYTHON_BIN -m wol_server_$SAFE_NAME --config $CONFIG_FILE
 WorkingDirectory=$BASE_DIR
 Restart=always
 User=$USER
@@ -266,5 +308,6 @@ echo "✅ Installation and configuration of $SERVICE_NAME complete!"
 echo "   Friendly Name: $FRIENDLY_NAME"
 echo "   Service File: $SERVICE_FILE"
 echo "   Script File: $TARGET_SCRIPT"
+echo "   Config File: $CONFIG_FILE (edits are applied live, no restart needed)"
 echo "   Venv Directory: $VENV_DIR"
 echo "🌐 Access your Wake-on-LAN server via: http://<your-server-ip>:$PORT/"
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""Shared setup for the wol_server tests: module patching and an in-process server."""
+
+import http.client
+import json
+import sys
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import wol_server
+from bench_wol_server import StubSender  # Swallows magic packets instead of broadcasting them
+
+__all__ = ['ServerTestCase', 'StubSender', 'wol_server']
+
+
+class ServerTestCase(unittest.TestCase):
+    """A TestCase that patches wol_server for one test and can serve it over HTTP."""
+
+    def patch(self, target, attribute, new=mock.DEFAULT, **kwargs):
+        """Replace target.attribute until the test ends. Returns the replacement."""
+        patcher = mock.patch.object(target, attribute, new, **kwargs)
+        replacement = patcher.start()
+        self.addCleanup(patcher.stop)
+        return replacement
+
+    def stub_effects(self):
+        """Send magic packets nowhere and lift the rate limits every test would otherwise trip."""
+        self.patch(wol_server, 'wol_sender', StubSender())
+        self.patch(wol_server.device_limiter, 'rate', 0)
+        self.patch(wol_server.client_limiter, 'rate', 0)
+
+    def serve(self, max_workers=2, **kwargs):
+        """Start the server on an ephemeral port for this test. Returns the port."""
+        self.httpd = wol_server.PooledHTTPServer(('127.0.0.1', 0), wol_server.RequestHandler,
+                                                 max_workers=max_workers, **kwargs)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+        return self.httpd.server_address[1]
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request on a new connection. Returns (response, body); a JSON body is decoded."""
+        if not hasattr(self, 'httpd'):
+            self.serve()
+        connection = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=5)
+        if body is not None and not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        data = response.read()
+        connection.close()
+        if response.getheader('Content-Type', '').startswith('application/json'):
+            data = json.loads(data)
+        return response, data
+
+    def get(self, path, headers=None):
+        return self.request('GET', path, headers=headers)[0]
@@ -0,0 +1,127 @@
+import time
+import unittest
+
+from helpers import ServerTestCase, wol_server
+
+
+class TokenAuthorityTest(ServerTestCase):
+    def setUp(self):
+        self.patch(wol_server, 'AUTH_SECRET', 'first secret')
+        self.auth = wol_server.TokenAuthority(cache_size=4)
+
+    def test_issued_token_verifies(self):
+        token = self.auth.issue(['view', 'wake'], 60)
+        self.assertEqual(self.auth.verify(token), {'view', 'wake'})
+        self.assertEqual(self.auth.verify(token), {'view', 'wake'})  # Now from the cache
+
+    def test_forged_tokens_are_refused(self):
+        token = self.auth.issue(['view'], 60)
+        scopes, expiry, nonce, signature = token.split('.')
+        forged = [
+            f'power.{expiry}.{nonce}.{signature}',  # Scopes widened
+            f'{scopes}.{int(expiry) + 86400}.{nonce}.{signature}',  # Expiry extended
+            f'{scopes}.{expiry}.{nonce}.{signature[:-2]}xx',  # Signature altered
+            f'{scopes}.{expiry}.{nonce}.' + wol_server.TokenAuthority._sign('other secret', f'{scopes}.{expiry}.{nonce}'),
+            'garbage', '', '...', f'{scopes}.soon.{nonce}.{signature}',
+        ]
+        for candidate in forged:
+            with self.subTest(token=candidate):
+                self.assertIsNone(self.auth.verify(candidate))
+
+    def test_expired_token_is_refused(self):
+        self.assertIsNone(self.auth.verify(self.auth.issue(['view'], -1)))
+
+    def test_cached_token_expires(self):
+        token = self.auth.issue(['view'], 1)
+        self.assertIsNotNone(self.auth.verify(token))
+        self.patch(wol_server.time, 'time', return_value=time.time() + 5)
+        self.assertIsNone(self.auth.verify(token))
+
+    def test_issue_rejects_unknown_scopes(self):
+        for scopes in ([], ['admin'], ['view', 'root']):
+            with self.subTest(scopes=scopes), self.assertRaises(ValueError):
+                self.auth.issue(scopes, 60)
+
+    def test_secret_change_revokes_cached_tokens(self):
+        token = self.auth.issue(['power'], 60)
+        self.assertEqual(self.auth.verify(token), {'power'})
+        self.patch(wol_server, 'AUTH_SECRET', 'second secret')
+        self.assertIsNone(self.auth.verify(token))
+        self.assertEqual(self.auth.verify(self.auth.issue(['power'], 60)), {'power'})
+
+    def test_reload_clears_the_cache(self):
+        self.patch(wol_server, 'auth', self.auth)
+        self.auth.verify(self.auth.issue(['view'], 60))
+        wol_server.configure_components({'AUTH_SECRET': 'second secret'})
+        self.assertEqual(len(self.auth._cache), 0)
+
+    def test_cache_is_bounded(self):
+        for _ in range(10):
+            self.auth.verify(self.auth.issue(['view'], 60))
+        self.assertEqual(len(self.auth._cache), 4)
+
+
+class RouteScopeTest(unittest.TestCase):
+    def test_public_routes(self):
+        for path in ('/login', '/logout', '/favicon.svg', '/favicon.ico'):
+            with self.subTest(path=path):
+                self.assertIsNone(wol_server._route_scope(path))
+
+    def test_scopes(self):
+        cases = [('/', 'GET', 'view'), ('/ping', 'GET', 'view'), ('/events', 'GET', 'view'),
+                 ('/metrics', 'GET', 'view'), ('/jobs', 'GET', 'view'), ('/jobs', 'POST', 'wake'),
+                 ('/jobs/nightly', 'DELETE', 'wake'), ('/wol', 'GET', 'wake'), ('/wol/bulk', 'GET', 'wake'),
+                 ('/devices/nas/wol', 'GET', 'wake'), ('/devices/nas', 'GET', 'view'),
+                 ('/pin/low', 'GET', 'power'), ('/pin/abort', 'GET', 'power'), ('/loginx', 'GET', 'view')]
+        for path, method, scope in cases:
+            with self.subTest(path=path, method=method):
+                self.assertEqual(wol_server._route_scope(path, method), scope)
+
+
+class AuthorizeTest(ServerTestCase):
+    def setUp(self):
+        self.patch(wol_server, 'AUTH_SECRET', 'secret')
+        self.patch(wol_server, 'auth', wol_server.TokenAuthority())
+        self.stub_effects()
+        wol_server.load_devices()
+
+    def bearer(self, *scopes):
+        return {'Authorization': f'Bearer {wol_server.auth.issue(scopes, 60)}'}
+
+    def test_missing_token(self):
+        response = self.get('/ping')
+        self.assertEqual(response.status, 401)
+        self.assertIn('Bearer', response.getheader('WWW-Authenticate'))
+        response, page = self.request('GET', '/')
+        self.assertEqual(response.status, 401)
+        self.assertIn(b'token', page)
+
+    def test_public_routes_stay_open(self):
+        self.assertEqual(self.get('/favicon.svg').status, 200)
+
+    def test_scope_is_enforced(self):
+        self.assertEqual(self.get('/ping', self.bearer('view')).status, 200)
+        response = self.get('/wol', self.bearer('view'))
+        self.assertEqual(response.status, 403)
+        self.assertIn('insufficient_scope', response.getheader('WWW-Authenticate'))
+        self.assertEqual(self.get('/wol', self.bearer('wake')).status, 200)
+
+    def test_session_cookie(self):
+        token = wol_server.auth.issue(['view'], 60)
+        response, _ = self.request('POST', '/login', f'token={token}',
+                                   {'Content-Type': 'application/x-www-form-urlencoded'})
+        self.assertEqual(response.status, 303)
+        cookie = response.getheader('Set-Cookie')
+        self.assertTrue(cookie.startswith(f'{wol_server.SESSION_COOKIE}={token};'))
+        self.assertIn('HttpOnly', cookie)
+        self.assertEqual(self.get('/ping', {'Cookie': f'theme=dark; {wol_server.SESSION_COOKIE}={token}'}).status, 200)
+        self.assertEqual(self.get('/ping', {'Cookie': f'{wol_server.SESSION_COOKIE}=forged'}).status, 401)
+
+    def test_bad_login(self):
+        response, _ = self.request('POST', '/login', 'token=forged', {'Content-Type': 'application/x-www-form-urlencoded'})
+        self.assertEqual(response.status, 401)
+        self.assertIsNone(response.getheader('Set-Cookie'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from helpers import wol_server
+
+
+class ParseSettingsTest(unittest.TestCase):
+    def test_defaults_are_within_range(self):
+        wol_server.parse_settings({name.lower(): value for name, value in wol_server.DEFAULT_SETTINGS.items()})
+
+    def test_out_of_range_values_are_rejected(self):
+        for setting in ({'HISTORY_SIZE': 0}, {'MAX_WORKERS': 0}, {'PING_INTERVAL': 0}, {'PROBE_TIMEOUT': -1},
+                        {'ACTION_RATE': -0.5}, {'PROBE_TCP_PORTS': [22, 70000]}, {'ACCESS_LOG_SAMPLE': 1.5},
+                        {'KEEPALIVE_TIMEOUT': float('nan')}, {'METRICS_LATENCY_BUCKETS': [0.5, 0.1]}):
+            with self.subTest(setting=setting), self.assertRaises(ValueError):
+                wol_server.parse_settings(setting)
+
+    def test_wrong_type_and_unknown_key(self):
+        for setting in ({'MAX_WORKERS': 2.5}, {'PING_INTERVAL': '5'}, {'NO_SUCH_SETTING': 1}):
+            with self.subTest(setting=setting), self.assertRaises(ValueError):
+                wol_server.parse_settings(setting)
+
+    def test_bad_reload_is_not_applied(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'config.json')
+            with open(path, 'w') as f:
+                json.dump({'PING_INTERVAL': 2, 'HISTORY_SIZE': 0}, f)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                wol_server.reload_config(path)
+        self.assertEqual(wol_server.PING_INTERVAL, wol_server.DEFAULT_SETTINGS['PING_INTERVAL'])
+        self.assertIn('HISTORY_SIZE must be at least 1', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
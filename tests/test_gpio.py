@@ -0,0 +1,92 @@
+import io
+import threading
+import time
+import unittest
+from unittest import mock
+
+from helpers import ServerTestCase, wol_server
+
+
+def _chip_info(label):
+    """A struct gpiochip_info as the GPIO_GET_CHIPINFO ioctl fills it."""
+    return b'gpiochip'.ljust(32, b'\0') + label.encode().ljust(32, b'\0') + (54).to_bytes(4, 'little')
+
+
+class FindGpioChipTest(unittest.TestCase):
+    def test_explicit_chip_is_kept(self):
+        self.assertEqual(wol_server.find_gpio_chip(2), 2)
+
+    def test_header_chip_found_by_label(self):
+        # A Pi 5 on an older kernel: the header sits on gpiochip4, behind the SoC's own chip
+        labels = {'/dev/gpiochip0': 'gpio-brcmstb@107d508500', '/dev/gpiochip4': 'pinctrl-rp1'}
+        opened = []
+
+        def fake_open(path, mode='r'):
+            opened.append(path)
+            return io.BytesIO()
+
+        with mock.patch.object(wol_server.os, 'listdir', return_value=['null', 'gpiochip4', 'gpiochip0']), \
+                mock.patch('builtins.open', fake_open), \
+                mock.patch('fcntl.ioctl', side_effect=lambda f, request, buffer: _chip_info(labels[opened[-1]])):
+            self.assertEqual(wol_server.find_gpio_chip(-1), 4)
+
+    def test_falls_back_to_chip_zero(self):
+        with mock.patch.object(wol_server.os, 'listdir', return_value=[]):
+            self.assertEqual(wol_server.find_gpio_chip(-1), 0)
+
+
+class MockBackendPressTest(ServerTestCase):
+    def setUp(self):
+        self.backend = wol_server.open_gpio_backend('17', 'mock')
+        self.patch(wol_server, 'gpio', self.backend)
+        self.stub_effects()
+
+    def test_open_gpio_backend(self):
+        self.assertIsInstance(self.backend, wol_server.MockGpioBackend)
+        self.assertEqual(self.backend.pin, 17)
+        self.assertIsNone(wol_server.open_gpio_backend('', 'mock'))
+
+    def test_timed_press_drives_the_line(self):
+        report = wol_server.press_engine.press_for(0.05, 'test')
+        self.assertEqual([edge for _, edge in self.backend.edges], ['press', 'release'])
+        (pressed, _), (released, _) = self.backend.edges
+        self.assertAlmostEqual((released - pressed) / 1e9, 0.05, delta=0.02)
+        self.assertAlmostEqual(report['achieved_ms'], 50, delta=20)
+        self.assertFalse(self.backend.pressed)
+
+    def test_pin_endpoints_press_and_release(self):
+        for path, pressed in (('/pin/low', True), ('/pin/high', False)):
+            self.assertEqual(self.get(path).status, 200)
+            self.assertEqual(self.backend.pressed, pressed)
+        self.assertEqual([edge for _, edge in self.backend.edges], ['press', 'release'])
+
+    def test_release_leaves_a_timed_press_alone(self):
+        hold = threading.Thread(target=wol_server.press_engine.press_for, args=(0.3, 'hold'))
+        hold.start()
+        time.sleep(0.05)
+        self.assertEqual(self.get('/pin/high').status, 409)
+        self.assertTrue(self.backend.pressed)
+        hold.join()
+        (pressed, _), (released, _) = self.backend.edges
+        self.assertAlmostEqual((released - pressed) / 1e9, 0.3, delta=0.05)
+
+    def test_abort_ends_a_timed_press(self):
+        outcome = {}
+
+        def hold():
+            try:
+                wol_server.press_engine.press_for(5, 'hold')
+            except RuntimeError as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(self.get('/pin/abort').status, 200)
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(self.backend.pressed)
+        self.assertIn('aborted', str(outcome['error']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import math
+import os
+import tempfile
+import unittest
+
+from helpers import wol_server
+
+
+class HistoryRingTest(unittest.TestCase):
+    def events(self, store):
+        return [(event['at'], event['kind'], event['device'], event['value'], event['amount'])
+                for event in store.query(0, 1000, points=100)['events']]
+
+    def test_rejects_an_empty_ring(self):
+        for size in (0, -1):
+            with self.subTest(size=size), self.assertRaises(ValueError):
+                wol_server.HistoryStore(path=None, size=size)
+
+    def test_oldest_events_are_dropped(self):
+        store = wol_server.HistoryStore(path=None, size=3)
+        for at in range(1, 6):
+            store.record('wol', 'nas', value=1, amount=at, at=at)
+        self.assertEqual(self.events(store), [(3, 'wol', 'nas', 1, 3), (4, 'wol', 'nas', 1, 4), (5, 'wol', 'nas', 1, 5)])
+
+    def test_wrapping_keeps_every_field(self):
+        store = wol_server.HistoryStore(path=None, size=2)
+        store.record('status', 'nas', value=1, amount=0.5, at=1)
+        store.record('press', amount=250, at=2)
+        store.record('status', 'pc', value=0, at=3)
+        self.assertEqual(self.events(store), [(2, 'press', None, None, 250), (3, 'status', 'pc', 0, None)])
+
+    def test_single_slot(self):
+        store = wol_server.HistoryStore(path=None, size=1)
+        store.record('wol', at=1)
+        store.record('press', at=2)
+        self.assertEqual(self.events(store), [(2, 'press', None, None, None)])
+
+    def test_file_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'history.tsv')
+            store = wol_server.HistoryStore(path=path, size=2)
+            for at in (1, 2, 3):
+                store.record('wol', 'nas', value=1, at=at)
+            store.flush()
+            with open(path, 'a') as f:
+                f.write('4.0\twol\tna')  # Cut short by a power loss
+            reloaded = wol_server.HistoryStore(path=path, size=3)
+            reloaded.load()  # Reads the last three lines and skips the broken one
+            self.assertEqual([event[0] for event in self.events(reloaded)], [2, 3])
+
+
+class HistoryQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.store = wol_server.HistoryStore(path=None, size=64)
+
+    def query(self, **kwargs):
+        return self.store.query(0, 100, points=4, **kwargs)
+
+    def test_uptime_share_per_bucket(self):
+        self.store.record('status', 'nas', value=1, at=30)
+        self.store.record('status', 'nas', value=0, at=60)
+        result = self.query()
+        self.assertEqual(result['bucket_seconds'], 25)
+        self.assertEqual([bucket['start'] for bucket in result['buckets']], [0, 25, 50, 75])
+        # Nothing known before 30, up until 60, down after
+        self.assertEqual([bucket['uptime'] for bucket in result['buckets']], [None, 1.0, 0.4, 0.0])
+
+    def test_state_before_the_window_counts(self):
+        self.store.record('status', 'nas', value=1, at=-10)
+        self.store.record('status', 'nas', value=0, at=90)
+        self.assertEqual([bucket['uptime'] for bucket in self.query()['buckets']], [1.0, 1.0, 1.0, 0.6])
+
+    def test_devices_are_averaged(self):
+        self.store.record('status', 'nas', value=1, at=0)
+        self.store.record('status', 'pc', value=0, at=0)
+        self.assertEqual([bucket['uptime'] for bucket in self.query()['buckets']], [0.5] * 4)
+        self.assertEqual([bucket['uptime'] for bucket in self.query(device_id='pc')['buckets']], [0.0] * 4)
+
+    def test_counts_per_bucket(self):
+        for at in (-1, 5, 26, 99, 100):
+            self.store.record('wol', 'nas', value=1, at=at)
+        self.store.record('press', amount=300, at=50)
+        self.store.record('wol', 'pc', value=1, at=80)
+        buckets = self.query()['buckets']
+        self.assertEqual([bucket['wol'] for bucket in buckets], [1, 1, 0, 2])
+        self.assertEqual([bucket['press'] for bucket in buckets], [0, 0, 1, 0])
+        # Presses concern no device, so they show up for every one
+        buckets = self.query(device_id='nas')['buckets']
+        self.assertEqual([bucket['wol'] for bucket in buckets], [1, 1, 0, 1])
+        self.assertEqual([bucket['press'] for bucket in buckets], [0, 0, 1, 0])
+
+    def test_events_are_capped_to_the_latest(self):
+        for at in (10, 20, 30, 40, 50, 60):
+            self.store.record('wol', 'nas', value=1, at=at)
+        result = self.query()
+        self.assertEqual([event['at'] for event in result['events']], [30, 40, 50, 60])
+        self.assertTrue(result['truncated'])
+        self.assertFalse(self.store.query(0, 100, points=6)['truncated'])
+
+    def test_amount_is_rounded_or_none(self):
+        self.store.record('status', 'nas', value=1, amount=1.23456, at=1)
+        self.store.record('status', 'nas', value=0, at=2)
+        events = self.query()['events']
+        self.assertEqual([event['amount'] for event in events], [1.235, None])
+        self.assertFalse(any(isinstance(event['amount'], float) and math.isnan(event['amount']) for event in events))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from helpers import ServerTestCase, wol_server
+
+
+class CronScheduleTest(unittest.TestCase):
+    def test_fields(self):
+        schedule = wol_server.CronSchedule('*/15 8-18/2 1,15 * 1-5')
+        self.assertEqual(schedule.minutes, {0, 15, 30, 45})
+        self.assertEqual(schedule.hours, {8, 10, 12, 14, 16, 18})
+        self.assertEqual(schedule.days, {1, 15})
+        self.assertEqual(schedule.weekdays, {1, 2, 3, 4, 5})
+
+    def test_sunday_is_zero_and_seven(self):
+        self.assertEqual(wol_server.CronSchedule('0 0 * * 7').weekdays, {0})
+
+    def test_invalid_expressions(self):
+        for expression in ('* * * *', '60 * * * *', 'x * * * *', '5-1 * * * *', '*/0 * * * *', '0 0 30 2 *'):
+            with self.subTest(expression=expression), self.assertRaises(ValueError):
+                wol_server.CronSchedule(expression)
+
+    def test_next_after(self):
+        start = datetime(2024, 1, 1, 10, 7, 30).timestamp()  # A Monday
+        self.assertEqual(wol_server.CronSchedule('*/15 * * * *').next_after(start),
+                         datetime(2024, 1, 1, 10, 15).timestamp())
+        self.assertEqual(wol_server.CronSchedule('55 1 * * *').next_after(start),
+                         datetime(2024, 1, 2, 1, 55).timestamp())
+        self.assertEqual(wol_server.CronSchedule('@monthly').next_after(start),
+                         datetime(2024, 2, 1, 0, 0).timestamp())
+        # Saturday 6 January comes before 15 January: either day field will do
+        self.assertEqual(wol_server.CronSchedule('0 9 15 * 6').next_after(start),
+                         datetime(2024, 1, 6, 9, 0).timestamp())
+
+    def test_strictly_after(self):
+        moment = datetime(2024, 1, 1, 10, 15).timestamp()
+        self.assertEqual(wol_server.CronSchedule('* * * * *').next_after(moment), moment + 60)
+
+
+class JobTimeTest(unittest.TestCase):
+    def test_delay(self):
+        self.assertEqual(wol_server._job_time({'delay': 90}, 1000.0), 1090.0)
+        self.assertEqual(wol_server._job_time({'delay': '30m'}, 1000.0), 2800.0)
+
+    def test_negative_delay_is_rejected(self):
+        for delay in (-1, '-5m'):
+            with self.subTest(delay=delay), self.assertRaises(ValueError):
+                wol_server._job_time({'delay': delay}, 1000.0)
+
+    def test_at(self):
+        self.assertEqual(wol_server._job_time({'at': 1234.5}, 0), 1234.5)
+        self.assertEqual(wol_server._job_time({'at': '2024-01-01T10:00:00'}, 0),
+                         datetime(2024, 1, 1, 10).timestamp())
+        with self.assertRaises(ValueError):
+            wol_server._job_time({'at': 'nan'}, 0)
+
+
+class SchedulerTestCase(ServerTestCase):
+    def setUp(self):
+        wol_server.load_devices()
+        self.device_id = wol_server.primary_device().id
+        self.stub_effects()
+        self.scheduler = wol_server.JobScheduler()
+        self.addCleanup(self.scheduler.stop)
+
+    def wait_for_runs(self, job_id, count=1, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.scheduler.get(job_id)
+            if len(job['runs']) >= count:
+                return job
+            time.sleep(0.02)
+        self.fail(f"job {job_id} did not run")
+
+
+class JobSchedulerTest(SchedulerTestCase):
+    def test_create_list_remove(self):
+        job = self.scheduler.create({'id': 'nightly', 'cron': '55 1 * * *', 'devices': self.device_id})
+        self.assertEqual(job['devices'], [self.device_id])
+        self.assertGreater(job['next_run'], time.time())
+        self.scheduler.create({'id': 'soon', 'delay': '1m'})
+        self.assertEqual([job['id'] for job in self.scheduler.list()], ['soon', 'nightly'])
+        with self.assertRaises(RuntimeError):
+            self.scheduler.create({'id': 'soon', 'delay': 5})
+        self.assertTrue(self.scheduler.remove('soon'))
+        self.assertFalse(self.scheduler.remove('soon'))
+        self.assertIsNone(self.scheduler.get('soon'))
+
+    def test_invalid_specs(self):
+        for spec in ({'delay': -5}, {'delay': 5, 'cron': '* * * * *'}, {}, {'delay': 5, 'colour': 'red'},
+                     {'delay': 5, 'devices': ['nope']}, {'id': 'a b', 'delay': 5}, {'cron': 'never'},
+                     {'at': time.time() - 3600}, []):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                self.scheduler.create(spec)
+
+    def test_due_job_runs(self):
+        self.scheduler.start()
+        self.scheduler.create({'id': 'now', 'delay': 0.1})
+        job = self.wait_for_runs('now')
+        self.assertEqual(job['runs'][0]['status'], 'ok')
+        self.assertIsNone(job['next_run'])
+
+    def test_cron_job_is_rescheduled_after_running(self):
+        self.scheduler.create({'id': 'every-minute', 'cron': '* * * * *'})
+        with self.scheduler._cond:
+            # Pretend it came due a moment ago
+            job = self.scheduler._jobs['every-minute']
+            job['next_run'] = time.time() - 1
+            self.scheduler._schedule(job)
+        self.scheduler.start()
+        job = self.wait_for_runs('every-minute')
+        self.assertEqual(job['runs'][0]['status'], 'ok')
+        self.assertGreater(job['next_run'], time.time())
+
+    def test_default_device_survives_a_rename(self):
+        job = self.scheduler.create({'id': 'main', 'delay': 0.1})
+        self.assertEqual(job['devices'], 'primary')
+        with mock.patch.object(wol_server, 'FRIENDLY_NAME', 'Renamed'):
+            wol_server.load_devices()
+            self.addCleanup(wol_server.load_devices)
+            self.assertNotEqual(wol_server.primary_device().id, self.device_id)
+            self.scheduler.start()
+            job = self.wait_for_runs('main')
+        self.assertEqual(job['runs'][0]['status'], 'ok')
+
+    def test_target_id_pins_the_default_device(self):
+        with mock.patch.object(wol_server, 'TARGET_ID', 'desk'), mock.patch.object(wol_server, 'FRIENDLY_NAME', 'Renamed'):
+            wol_server.load_devices()
+        self.addCleanup(wol_server.load_devices)
+        self.assertEqual(list(wol_server.DEVICES), ['desk'])
+
+    def test_late_saved_job_is_missed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'jobs.json')
+            due = time.time() - wol_server.JOB_MISFIRE_GRACE - 60
+            with open(path, 'w') as f:
+                json.dump({'jobs': [{'id': 'late', 'name': 'late', 'devices': [self.device_id], 'options': {},
+                                     'created': due - 60, 'at': due, 'next_run': due, 'runs': []}]}, f)
+            self.scheduler.path = path
+            self.scheduler.start()
+            job = self.wait_for_runs('late')
+            self.assertEqual(job['runs'][0]['status'], 'missed')
+            self.assertIsNone(job['next_run'])
+            self.scheduler.stop()
+            self.scheduler.save()  # Settles the file, which the run's own save may still be writing
+            with open(path) as f:
+                self.assertEqual(json.load(f)['jobs'][0]['runs'][0]['status'], 'missed')
+
+
+class JobsApiTest(SchedulerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch(wol_server, 'jobs', self.scheduler)
+
+    def test_lifecycle(self):
+        response, job = self.request('POST', '/jobs', {'id': 'nightly', 'cron': '55 1 * * *'})
+        self.assertEqual(response.status, 201)
+        self.assertEqual(response.getheader('Location'), '/jobs/nightly')
+        self.assertEqual(self.request('GET', '/jobs')[1]['jobs'][0]['id'], 'nightly')
+        response, fetched = self.request('GET', '/jobs/nightly')
+        self.assertEqual((response.status, fetched['cron']), (200, '55 1 * * *'))
+        self.assertEqual(self.request('POST', '/jobs', {'id': 'nightly', 'delay': 5})[0].status, 409)
+        self.assertEqual(self.request('DELETE', '/jobs/nightly')[0].status, 200)
+        self.assertEqual(self.request('DELETE', '/jobs/nightly')[0].status, 404)
+        self.assertEqual(self.request('GET', '/jobs')[1]['jobs'], [])
+
+    def test_invalid_job(self):
+        response, body = self.request('POST', '/jobs', {'delay': -10})
+        self.assertEqual(response.status, 400)
+        self.assertEqual(body['status'], 'error')
+
+
+if __name__ == '__main__':
+    unittest.main()
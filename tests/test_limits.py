@@ -0,0 +1,127 @@
+import threading
+import time
+import unittest
+
+from helpers import ServerTestCase, wol_server
+
+
+class Clock:
+    """Stands in for the time module, so buckets refill only when the test says so."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class RateLimiterTest(ServerTestCase):
+    def setUp(self):
+        self.clock = self.patch(wol_server, 'time', Clock())
+
+    def test_burst_then_refill(self):
+        limiter = wol_server.RateLimiter(rate=2.0, burst=3)
+        self.assertEqual([limiter.acquire('a') for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(limiter.acquire('a'), 0.5)
+        self.clock.now += 0.25
+        self.assertAlmostEqual(limiter.acquire('a'), 0.25)  # Half a token back, half still missing
+        self.clock.now += 0.25
+        self.assertEqual(limiter.acquire('a'), 0.0)
+        self.clock.now += 60
+        self.assertEqual([limiter.acquire('a') for _ in range(3)], [0.0, 0.0, 0.0])  # Capped at burst
+
+    def test_keys_are_independent(self):
+        limiter = wol_server.RateLimiter(rate=1.0, burst=1)
+        self.assertEqual(limiter.acquire('a'), 0.0)
+        self.assertGreater(limiter.acquire('a'), 0)
+        self.assertEqual(limiter.acquire('b'), 0.0)
+
+    def test_zero_rate_disables_the_limit(self):
+        limiter = wol_server.RateLimiter(rate=0, burst=1)
+        self.assertEqual([limiter.acquire('a') for _ in range(10)], [0.0] * 10)
+
+    def test_only_recent_keys_are_kept(self):
+        limiter = wol_server.RateLimiter(rate=1.0, burst=1, max_keys=2)
+        for key in 'abc':
+            limiter.acquire(key)
+        self.assertEqual(list(limiter._buckets), ['b', 'c'])
+
+    def test_check_raises(self):
+        limiter = wol_server.RateLimiter(rate=0.5, burst=1)
+        limiter.check('a', 'client', 'slow down')
+        with self.assertRaises(wol_server.RateLimited) as caught:
+            limiter.check('a', 'client', 'slow down')
+        self.assertAlmostEqual(caught.exception.retry_after, 2.0)
+        self.assertEqual(str(caught.exception), 'slow down')
+
+
+class RateLimitedResponseTest(ServerTestCase):
+    def test_429_with_retry_after(self):
+        wol_server.load_devices()
+        self.stub_effects()
+        self.patch(wol_server, 'client_limiter', wol_server.RateLimiter(rate=0.4, burst=2))
+        self.assertEqual([self.get('/wol').status for _ in range(2)], [200, 200])
+        response, body = self.request('GET', '/wol')
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.getheader('Retry-After'), '3')  # 2.5s, rounded up
+        self.assertAlmostEqual(body['retry_after'], 2.5, delta=0.1)
+        # Releasing the button is never limited
+        self.patch(wol_server, 'gpio', wol_server.MockGpioBackend(17))
+        self.assertEqual(self.get('/pin/high').status, 200)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def run_concurrently(self, flight, action, callers=5):
+        outcomes = [None] * callers
+
+        def call(index):
+            try:
+                outcomes[index] = flight.do(('test', 'key'), action)
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=call, args=(index,)) for index in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_callers_share_one_result(self):
+        flight, calls, release = wol_server.SingleFlight(), [], threading.Event()
+
+        def action():
+            calls.append(1)
+            release.wait(5)
+            return {'status': 'ok'}
+
+        timer = threading.Timer(0.3, release.set)
+        timer.start()
+        outcomes = self.run_concurrently(flight, action)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is outcomes[0][0] for result, _ in outcomes))
+        self.assertEqual(sorted(shared for _, shared in outcomes), [False, True, True, True, True])
+
+    def test_an_exception_reaches_every_caller(self):
+        flight, calls = wol_server.SingleFlight(), []
+
+        def action():
+            calls.append(1)
+            time.sleep(0.3)
+            raise OSError('no network')
+
+        outcomes = self.run_concurrently(flight, action)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(outcome, OSError) and str(outcome) == 'no network' for outcome in outcomes))
+
+    def test_a_finished_call_is_not_reused(self):
+        flight = wol_server.SingleFlight()
+        self.assertEqual(flight.do('key', lambda: 1), (1, False))
+        self.assertEqual(flight.do('key', lambda: 2), (2, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import socket
+import time
+import unittest
+
+from helpers import ServerTestCase, wol_server
+
+
+class ProbeTcpTest(unittest.TestCase):
+    def test_listening_port_answers(self):
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen()
+            rtt = wol_server.probe_tcp('127.0.0.1', ports=(server.getsockname()[1],), timeout=1.0)
+        self.assertIsNotNone(rtt)
+        self.assertLess(rtt, 1.0)
+
+    def test_refused_port_counts_as_up(self):
+        with socket.socket() as closed:
+            closed.bind(('127.0.0.1', 0))
+            port = closed.getsockname()[1]
+        self.assertIsNotNone(wol_server.probe_tcp('127.0.0.1', ports=(port,), timeout=1.0))
+
+    def test_any_answering_port_wins(self):
+        with socket.socket() as server, socket.socket() as closed:
+            server.bind(('127.0.0.1', 0))
+            server.listen()
+            closed.bind(('127.0.0.1', 0))
+            ports = (closed.getsockname()[1], server.getsockname()[1])
+            self.assertIsNotNone(wol_server.probe_tcp('127.0.0.1', ports=ports, timeout=1.0))
+
+    def test_silent_host_costs_one_timeout(self):
+        # A listener whose accept queue is full drops further SYNs, like a host that is down
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(0)
+            port = server.getsockname()[1]
+            backlog = []
+            try:
+                while True:
+                    client = socket.socket()
+                    backlog.append(client)
+                    client.settimeout(0.2)
+                    client.connect(('127.0.0.1', port))
+            except OSError:
+                pass
+            started = time.monotonic()
+            try:
+                self.assertIsNone(wol_server.probe_tcp('127.0.0.1', ports=(port,) * 7, timeout=0.3))
+            finally:
+                for client in backlog:
+                    client.close()
+        # The ports share one deadline instead of taking 0.3s each
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+class ProbeArpTest(unittest.TestCase):
+    def test_only_reachable_entries_count(self):
+        neighbours = {'10.0.0.1': ('aabbccddeeff', True), '10.0.0.2': ('aabbccddee00', False),
+                      '10.0.0.3': (None, False)}
+        self.assertTrue(wol_server.probe_arp('10.0.0.1', neighbours))
+        self.assertFalse(wol_server.probe_arp('10.0.0.2', neighbours))
+        self.assertFalse(wol_server.probe_arp('10.0.0.3', neighbours))
+        self.assertFalse(wol_server.probe_arp('10.0.0.4', neighbours))
+
+
+class ProbeManyTest(ServerTestCase):
+    def setUp(self):
+        self.retried = []
+        self.patch(wol_server, 'probe_icmp_many', return_value={})
+        self.patch(wol_server, 'probe_target', side_effect=self._probe_target)
+
+    def _probe_target(self, ip, methods, timeout, neighbours):
+        self.retried.append(ip)
+        time.sleep(0.1)
+        return False, None, None
+
+    def test_sweep_only_ips_are_not_retried(self):
+        results = wol_server.probe_many(['10.0.0.1', '10.0.0.2'], methods=('icmp', 'tcp'), sweep_only={'10.0.0.1'})
+        self.assertEqual(self.retried, ['10.0.0.2'])
+        self.assertEqual(results['10.0.0.1'], (False, None, None))
+
+    def test_no_retry_starts_after_the_deadline(self):
+        ips = [f'10.0.0.{n}' for n in range(1, 41)]
+        results = wol_server.probe_many(ips, methods=('icmp', 'tcp'), concurrency=2,
+                                        deadline=time.monotonic() + 0.25)
+        self.assertLess(len(self.retried), 10)
+        self.assertEqual(len(results), len(ips))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import socket
+import time
+import unittest
+
+from helpers import ServerTestCase, wol_server
+
+
+class PerClientCapTest(ServerTestCase):
+    def setUp(self):
+        self.port = self.serve(max_workers=4, max_per_client=2)
+
+    def connect(self):
+        connection = socket.create_connection(('127.0.0.1', self.port))
+        self.addCleanup(connection.close)
+        return connection
+
+    def test_event_streams_do_not_count(self):
+        for _ in range(3):
+            self.connect().sendall(b'GET /events HTTP/1.1\r\nHost: test\r\n\r\n')
+        time.sleep(0.3)
+        self.assertEqual(self.get('/ping').status, 200)
+
+    def test_over_the_cap_gets_429(self):
+        idle = [self.connect() for _ in range(2)]
+        time.sleep(0.2)
+        response = self.get('/ping')
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.getheader('Retry-After'), '1')
+        for connection in idle:
+            connection.close()
+
+
+class RouteLabelTest(unittest.TestCase):
+    def test_device_routes(self):
+        self.assertEqual(wol_server._route_label('/devices/nas'), '/devices/{id}')
+        self.assertEqual(wol_server._route_label('/devices/nas/wol'), '/devices/{id}/wol')
+        self.assertEqual(wol_server._route_label('/devices/nas/wakes/'), '/devices/{id}/wakes')
+
+    def test_unknown_paths_share_one_label(self):
+        for path in ('/devices/nas/AAAA', '/devices/nas/wol/x', '/nope', '/pin/sideways'):
+            with self.subTest(path=path):
+                self.assertEqual(wol_server._route_label(path), 'other')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,506 +1,3255 @@
 #!/usr/bin/env python3
 
-import subprocess
+import base64
+import bisect
+import errno
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
 import json
+import math
+import os
+import queue
+import random
+import re
+import select
+import socket
+import struct
+import sys
 import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from html import escape
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from wakeonlan import send_magic_packet
-import sys
-
-try:
-    import RPi.GPIO as GPIO
-except ImportError:
-    GPIO = None
+from urllib.parse import parse_qs, urlsplit
 
 # --- Configuration ---
-# These values are placeholders and will be overwritten by the installer.
+# Defaults only: the installer writes the real values to a config file (see CONFIG_POLL_INTERVAL).
 TARGET_MAC = '00:11:22:33:44:55'
 TARGET_IP = '192.168.1.100'
 BROADCAST_IP = '192.168.1.255'
 PORT = 8000
 FRIENDLY_NAME = 'My Device'
-HW_PIN = '' # Installer will overwrite this
+# Id of that device in /devices, history and jobs; empty derives it from FRIENDLY_NAME.
+# Set it to keep the id (and what was recorded under it) when the name changes.
+TARGET_ID = ''
+HW_PIN = ''
+# Dashboard template; empty means wol_page.html next to this script
+PAGE_FILE = ''
+
+# Fleet mode: path to a JSON device registry, either a list of devices or {"devices": [...]}.
+# Each entry needs "mac" and "ip"; "id", "name" and "broadcast" are optional.
+# When empty, the single device described above is served.
+DEVICES_FILE = ''
+
+# Reachability monitor: how often every device is probed in the background, and how
+# old (in seconds) the last result may be before /ping reports it as stale.
+PING_INTERVAL = 5.0
+PING_STALE_AFTER = 15.0
+# In-process prober: methods are tried in order until one gets an answer.
+# 'icmp' uses an unprivileged datagram or raw ICMP socket when the kernel allows it,
+# 'tcp' connects to all PROBE_TCP_PORTS at once (a refused connection still proves the host is up),
+# 'arp' checks for an entry the kernel confirmed recently (REACHABLE) in its neighbour table.
+PROBE_METHODS = ('icmp', 'tcp', 'arp')
+PROBE_TCP_PORTS = (22, 80, 135, 139, 443, 445, 3389)
+PROBE_TIMEOUT = 0.5
+# Devices that miss the ICMP sweep are re-probed with the other methods in parallel.
+# A device that was down on the last cycle only gets the ICMP sweep; the other methods are
+# tried again every PROBE_DOWN_RETRY_CYCLES cycles. A cycle starts no new probes after
+# PING_INTERVAL seconds, and whatever is left over counts as down.
+PROBE_CONCURRENCY = 32
+PROBE_DOWN_RETRY_CYCLES = 6
+# Presence: each monitor cycle first reads the kernel neighbour table (netlink, or
+# /proc/net/arp) once for every device. A device whose entry the kernel confirmed
+# recently (REACHABLE) counts as up without a probe; only the rest are probed as above.
+# With PRESENCE_VERIFY_MAC, an IP whose entry holds another MAC (its DHCP lease went to
+# another machine) is reported as mac_mismatch and the device is looked for by its MAC;
+# if the MAC is nowhere in the table (repeaters, bridges, proxy-ARP) the IP is still probed.
+PRESENCE_NEIGHBOURS = True
+PRESENCE_VERIFY_MAC = True
+# Requests are served concurrently by a bounded pool of worker threads. When every
+# worker is busy, up to MAX_WORKERS more connections wait their turn; further ones get
+# 503 at once, so accepting never stalls. Event streams run outside the pool.
+MAX_WORKERS = 16
+# HTTP/1.1 keep-alive: an idle connection is closed after KEEPALIVE_TIMEOUT seconds,
+# since it holds a worker while it waits. One client address may hold at most
+# MAX_CONNECTIONS_PER_CLIENT connections (event streams and wake-and-wait requests
+# aside); further ones get 429 on accept.
+KEEPALIVE_TIMEOUT = 5.0
+MAX_CONNECTIONS_PER_CLIENT = 4
+# Server-push status stream (/events). Each open dashboard holds a thread of its own,
+# outside the worker pool; past MAX_EVENT_CLIENTS streams, dashboards poll /ping instead.
+MAX_EVENT_CLIENTS = 32
+EVENT_KEEPALIVE = 15.0
+EVENT_QUEUE_SIZE = 32
+# Magic packets: UDP port, and how each batch is paced. Every device gets WOL_REPEAT
+# packets WOL_SPACING seconds apart; consecutive devices start WOL_STAGGER seconds
+# apart so a mass wake-up does not power every PSU on at the same instant.
+# /wol and /wol/bulk accept repeat, spacing_ms and stagger_ms to override them.
+WOL_PORT = 9
+WOL_REPEAT = 1
+WOL_SPACING = 0.05
+WOL_STAGGER = 0.0
+WOL_MAX_REPEAT = 10
+WOL_MAX_BATCH_SECONDS = 600.0
+# Wake-and-wait (/wol?wait=<seconds>): after sending, the device is probed with
+# exponential backoff until it answers or the wait runs out. The measured wake
+# latencies of the last WAKE_HISTORY_SIZE waits are kept per device.
+WAKE_MAX_WAIT = 300.0
+WAKE_PROBE_INITIAL = 0.25
+WAKE_PROBE_MAX_INTERVAL = 5.0
+WAKE_HISTORY_SIZE = 50
+# Instrumentation: latency histogram buckets (seconds) used by /metrics, and the
+# fraction of requests written to the access log (0 disables it, 1 logs every request).
+# Errors are always logged.
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ACCESS_LOG_SAMPLE = 0.0
+# GPIO backend driving HW_PIN: 'lgpio', 'gpiod' (libgpiod character device), 'rpi'
+# (RPi.GPIO), 'mock' (in-memory, for testing without a Pi) or 'auto' to use the first
+# of lgpio, gpiod and rpi that is installed. GPIO_CHIP is the /dev/gpiochipN the pin is on
+# (lgpio and gpiod); -1 finds the chip of the 40-pin header by its label, as rpi-lgpio
+# does, so a Pi 5 works whichever number its kernel gave the chip.
+GPIO_BACKEND = 'auto'
+GPIO_CHIP = -1
+# Timed actions: /pin/pulse and /pin/hold defaults and the longest hold allowed (ms).
+# /pin/high does not end a timed press; /pin/abort does.
+# The timing thread sleeps until PIN_SPIN_MARGIN seconds before the deadline, then spins.
+PIN_PULSE_MS = 200
+PIN_HOLD_MS = 5000
+PIN_MAX_HOLD_MS = 15000
+PIN_SPIN_MARGIN = 0.002
+# A manual press (/pin/low) is released automatically after this many seconds
+PIN_SAFETY_TIMEOUT = 30.0
+# Rate limits (token buckets): each client address may trigger ACTION_RATE actions per
+# second, in bursts of up to ACTION_BURST; each device may be woken, and the power button
+# pressed, DEVICE_RATE times per second in bursts of up to DEVICE_BURST. Actions over the
+# limit get 429 with Retry-After. /pin/high and /pin/abort are never limited. A rate of 0 disables a limit.
+ACTION_RATE = 2.0
+ACTION_BURST = 10
+DEVICE_RATE = 0.5
+DEVICE_BURST = 5
+# State history: reachability changes, magic packets and button presses are kept in a
+# fixed-size ring of HISTORY_SIZE events and appended to HISTORY_FILE every
+# HISTORY_FLUSH_INTERVAL seconds, one write per interval to spare SD cards. Once the file
+# outgrows HISTORY_FILE_MAX_BYTES it is rewritten from the ring. Empty keeps it in memory only.
+HISTORY_FILE = ''
+HISTORY_SIZE = 8192
+HISTORY_FLUSH_INTERVAL = 60.0
+HISTORY_FILE_MAX_BYTES = 1 << 20
+# /history returns at most this many buckets (and raw events before it truncates)
+HISTORY_MAX_POINTS = 500
+# API authentication: with AUTH_SECRET set, every request but the favicons and the login form
+# needs a token signed with it, sent as "Authorization: Bearer <token>" or in the session cookie
+# that /login sets. A token grants scopes: view (page, status, history, metrics), wake (magic
+# packets) and power (the button). Issue one with --issue-token view,wake; it expires after
+# AUTH_TOKEN_DAYS, and changing the secret revokes every token. The AUTH_CACHE_SIZE most
+# recently verified tokens skip the HMAC. Empty leaves the API open.
+AUTH_SECRET = ''
+AUTH_TOKEN_DAYS = 365.0
+AUTH_CACHE_SIZE = 256
+# Scheduled wake-ups (/jobs): one-shot ("at" a time or after a "delay") and cron jobs,
+# kept in JOBS_FILE across restarts (empty keeps them in memory only). A single timer
+# thread fires them and JOB_WORKERS threads run them; each job keeps its last
+# JOB_RUNS_KEPT outcomes. A job that comes due more than JOB_MISFIRE_GRACE seconds late
+# (the server was down, or the clock jumped at boot) is recorded as missed, not run.
+JOBS_FILE = ''
+JOBS_MAX = 256
+JOB_WORKERS = 2
+JOB_RUNS_KEPT = 10
+JOB_MISFIRE_GRACE = 300.0
+# Any setting above can be overridden by a JSON file of {"NAME": value} pairs, given
+# with --config <path>. The file is watched (with inotify, or by checking its mtime every
+# CONFIG_POLL_INTERVAL seconds) and edits are applied live; RESTART_SETTINGS need a restart.
+CONFIG_POLL_INTERVAL = 2.0
+
+DEFAULT_SETTINGS = {name: value for name, value in list(globals().items()) if name.isupper()}
+# (minimum, maximum) of the numeric settings, None for no maximum; a tuple setting's
+# limits apply to each of its items. A config file outside them is not applied.
+SETTING_RANGES = {
+    'PORT': (1, 65535), 'PING_INTERVAL': (0.1, None), 'PING_STALE_AFTER': (0.1, None),
+    'PROBE_TCP_PORTS': (1, 65535), 'PROBE_TIMEOUT': (0.01, None), 'PROBE_CONCURRENCY': (1, None),
+    'PROBE_DOWN_RETRY_CYCLES': (1, None), 'MAX_WORKERS': (1, None), 'KEEPALIVE_TIMEOUT': (0.1, None),
+    'MAX_CONNECTIONS_PER_CLIENT': (1, None), 'MAX_EVENT_CLIENTS': (0, None), 'EVENT_KEEPALIVE': (1.0, None),
+    'EVENT_QUEUE_SIZE': (1, None), 'WOL_PORT': (0, 65535), 'WOL_REPEAT': (1, None), 'WOL_SPACING': (0.0, None),
+    'WOL_STAGGER': (0.0, None), 'WOL_MAX_REPEAT': (1, None), 'WOL_MAX_BATCH_SECONDS': (0.0, None),
+    'WAKE_MAX_WAIT': (0.0, None), 'WAKE_PROBE_INITIAL': (0.01, None), 'WAKE_PROBE_MAX_INTERVAL': (0.01, None),
+    'WAKE_HISTORY_SIZE': (1, None), 'METRICS_LATENCY_BUCKETS': (0.0, None), 'ACCESS_LOG_SAMPLE': (0.0, 1.0),
+    'GPIO_CHIP': (-1, None), 'PIN_PULSE_MS': (1, None), 'PIN_HOLD_MS': (1, None), 'PIN_MAX_HOLD_MS': (1, None),
+    'PIN_SPIN_MARGIN': (0.0, 1.0), 'PIN_SAFETY_TIMEOUT': (0.1, None), 'ACTION_RATE': (0.0, None),
+    'ACTION_BURST': (1, None), 'DEVICE_RATE': (0.0, None), 'DEVICE_BURST': (1, None), 'HISTORY_SIZE': (1, None),
+    'HISTORY_FLUSH_INTERVAL': (0.1, None), 'HISTORY_FILE_MAX_BYTES': (1, None), 'HISTORY_MAX_POINTS': (1, None),
+    'AUTH_TOKEN_DAYS': (0.0, None), 'AUTH_CACHE_SIZE': (0, None), 'JOBS_MAX': (1, None), 'JOB_WORKERS': (1, None),
+    'JOB_RUNS_KEPT': (1, None), 'JOB_MISFIRE_GRACE': (0.0, None), 'CONFIG_POLL_INTERVAL': (0.1, None),
+}
+RESTART_SETTINGS = {'PORT', 'MAX_WORKERS', 'MAX_CONNECTIONS_PER_CLIENT', 'METRICS_LATENCY_BUCKETS',
+                    'HISTORY_SIZE', 'WAKE_HISTORY_SIZE', 'JOBS_FILE', 'JOB_WORKERS'}
+
+# --- GPIO backends ---
+class GpioBackend:
+    """The power-button line, claimed once at startup and driven as open drain.
+
+    Pressing pulls the line LOW; releasing leaves it floating (high impedance),
+    like a real button's open circuit. Backends request the line in __init__ and
+    keep the handle, so press() and release() are a single write each.
+    """
+
+    name = ''
+
+    def __init__(self, pin):
+        self.pin = pin
+
+    def press(self):
+        raise NotImplementedError
+
+    def release(self):
+        raise NotImplementedError
+
+    def close(self):
+        """Release the line (floating) and give it back to the kernel."""
+
+# Labels of the controller wired to the 40-pin header: Pi 5, Pi 4, and every earlier model
+GPIO_HEADER_CHIP_LABELS = ('pinctrl-rp1', 'pinctrl-bcm2711', 'pinctrl-bcm2835')
+GPIO_GET_CHIPINFO_IOCTL = 0x8044B401  # _IOR(0xB4, 0x01, struct gpiochip_info), 68 bytes
+
+def find_gpio_chip(chip=None):
+    """Resolve chip (GPIO_CHIP by default) to a /dev/gpiochipN number.
+
+    -1 means the chip whose label is one of GPIO_HEADER_CHIP_LABELS; when no
+    chip carries such a label, 0 is used as before.
+    """
+    chip = GPIO_CHIP if chip is None else chip
+    if chip >= 0:
+        return chip
+    import fcntl
+    try:
+        chips = sorted(int(name[len('gpiochip'):]) for name in os.listdir('/dev') if re.fullmatch(r'gpiochip\d+', name))
+    except OSError:
+        return 0
+    for number in chips:
+        try:
+            with open(f'/dev/gpiochip{number}', 'rb') as f:
+                info = fcntl.ioctl(f, GPIO_GET_CHIPINFO_IOCTL, bytes(68))  # struct gpiochip_info
+        except OSError:
+            continue
+        label = info[32:64].split(b'\0', 1)[0].decode(errors='replace')
+        if label.startswith(GPIO_HEADER_CHIP_LABELS):
+            return number
+    return 0
+
+class LgpioBackend(GpioBackend):
+    """lgpio (the library under rpi-lgpio): a true open-drain output, so a write is all it takes."""
+
+    name = 'lgpio'
+
+    def __init__(self, pin, chip=None):
+        import lgpio
+        super().__init__(pin)
+        self._write = lgpio.gpio_write
+        self._handle = lgpio.gpiochip_open(find_gpio_chip(chip))
+        try:
+            lgpio.gpio_claim_output(self._handle, pin, 1, lgpio.SET_OPEN_DRAIN)
+        except Exception:
+            lgpio.gpiochip_close(self._handle)
+            raise
+        self._lgpio = lgpio
+
+    def press(self):
+        self._write(self._handle, self.pin, 0)
+
+    def release(self):
+        self._write(self._handle, self.pin, 1)
+
+    def close(self):
+        self.release()
+        self._lgpio.gpio_free(self._handle, self.pin)
+        self._lgpio.gpiochip_close(self._handle)
+
+class GpiodBackend(GpioBackend):
+    """libgpiod character device (/dev/gpiochipN) as an open-drain output; supports the v1 and v2 bindings."""
 
-safety_timer = None
+    name = 'gpiod'
 
-def reset_pin_high():
-    """Safety function to release the pin (high impedance) after 30 seconds."""
-    global safety_timer
-    if GPIO and HW_PIN:
+    def __init__(self, pin, chip=None):
+        import gpiod
+        super().__init__(pin)
+        path = f'/dev/gpiochip{find_gpio_chip(chip)}'
+        if hasattr(gpiod, 'request_lines'):
+            from gpiod.line import Direction, Drive, Value
+            settings = gpiod.LineSettings(direction=Direction.OUTPUT, drive=Drive.OPEN_DRAIN,
+                                          output_value=Value.ACTIVE)
+            self._request = gpiod.request_lines(path, consumer='wol_server', config={pin: settings})
+            self._low, self._high = Value.INACTIVE, Value.ACTIVE
+            set_value = self._request.set_value
+            self._set = lambda value: set_value(pin, value)
+        else:
+            line = gpiod.Chip(path).get_line(pin)
+            line.request(consumer='wol_server', type=gpiod.LINE_REQ_DIR_OUT,
+                         flags=gpiod.LINE_REQ_FLAG_OPEN_DRAIN, default_vals=[1])
+            self._request = line
+            self._low, self._high = 0, 1
+            self._set = line.set_value
+
+    def press(self):
+        self._set(self._low)
+
+    def release(self):
+        self._set(self._high)
+
+    def close(self):
+        self.release()
+        self._request.release()
+
+class RPiGpioBackend(GpioBackend):
+    """RPi.GPIO has no open-drain mode, so releasing switches the pin back to INPUT.
+
+    That makes each action a setup() call rather than a plain write; the pin
+    number is still parsed once and the module set up once.
+    """
+
+    name = 'rpi'
+
+    def __init__(self, pin):
+        import RPi.GPIO as GPIO
+        super().__init__(pin)
+        GPIO.setwarnings(False)
+        GPIO.setmode(GPIO.BCM)
+        # Default state is INPUT (button released / High-Z)
+        GPIO.setup(pin, GPIO.IN)
+        self._gpio = GPIO
+        self._setup, self._out, self._in, self._low = GPIO.setup, GPIO.OUT, GPIO.IN, GPIO.LOW
+
+    def press(self):
+        self._setup(self.pin, self._out, initial=self._low)
+
+    def release(self):
+        self._setup(self.pin, self._in)
+
+    def close(self):
+        self.release()
+        self._gpio.cleanup()
+
+class MockGpioBackend(GpioBackend):
+    """In-memory line for tests and benchmarks.
+
+    Every press and release appends (perf_counter_ns(), 'press'|'release') to
+    edges, so press timing can be measured without hardware.
+    """
+
+    name = 'mock'
+
+    def __init__(self, pin, max_edges=100000):
+        super().__init__(pin)
+        self.pressed = False
+        self.edges = deque(maxlen=max_edges)
+
+    def press(self):
+        self.edges.append((time.perf_counter_ns(), 'press'))
+        self.pressed = True
+
+    def release(self):
+        self.edges.append((time.perf_counter_ns(), 'release'))
+        self.pressed = False
+
+    def close(self):
+        self.release()
+
+GPIO_BACKENDS = {'lgpio': LgpioBackend, 'gpiod': GpiodBackend, 'rpi': RPiGpioBackend, 'mock': MockGpioBackend}
+
+def open_gpio_backend(pin=None, backend=None):
+    """Claim the button line with the configured backend.
+
+    Returns None when no pin is configured. Raises ImportError or OSError if the
+    backend (or, for 'auto', every backend) is unavailable.
+    """
+    pin = HW_PIN if pin is None else pin
+    backend = GPIO_BACKEND if backend is None else backend
+    if pin in ('', None):
+        return None
+    pin = int(pin)
+    if backend != 'auto':
+        return GPIO_BACKENDS[backend](pin)
+    errors = []
+    for name in ('lgpio', 'gpiod', 'rpi'):
         try:
-            # Set to INPUT to simulate a released button (open circuit)
-            GPIO.setup(int(HW_PIN), GPIO.IN)
-            print(f"Safety timeout: Pin {HW_PIN} automatically released.")
+            return GPIO_BACKENDS[name](pin)
+        except Exception as e:  # lgpio raises its own lgpio.error
+            errors.append(f"{name}: {e}")
+    raise ImportError('; '.join(errors))
+
+gpio = None  # The open GpioBackend, or None when HW_PIN is unset or unavailable
+
+# Requests run concurrently, so the pin state and its safety timer change together under gpio_lock
+gpio_lock = threading.Lock()
+
+# --- Metrics ---
+class Metrics:
+    """Minimal Prometheus-style registry: counters, gauges and histograms.
+
+    Updating a metric is a dict lookup and an addition under one lock, so it
+    can be called on every request without measurable cost.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}  # name -> (type, help, buckets)
+        self._values = {}  # name -> {labels tuple: value, or [bucket counts..., sum, count] for histograms}
+
+    def define(self, name, kind, help_text, buckets=None):
+        self._meta[name] = (kind, help_text, buckets)
+        self._values[name] = {}
+
+    def set_buckets(self, name, buckets):
+        """Change a histogram's buckets, dropping what it recorded so far."""
+        with self._lock:
+            kind, help_text, _ = self._meta[name]
+            self._meta[name] = (kind, help_text, tuple(buckets))
+            self._values[name] = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._values[name]
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(buckets) + 3)  # buckets, +Inf, sum, count
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._values[name].get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            snapshot = {name: {key: (list(value) if isinstance(value, list) else value)
+                               for key, value in series.items()} for name, series in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in snapshot[name].items():
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(key)} {value!r}')
+                    continue
+                cumulative = 0
+                for bound, count in zip((*buckets, '+Inf'), value):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else f'{bound:g}'
+                    lines.append(f'{name}_bucket{_format_labels(key + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(key)} {value[-2]!r}')
+                lines.append(f'{name}_count{_format_labels(key)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(key):
+    if not key:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(key, escaped)) + '}'
+
+metrics = Metrics()
+metrics.define('wol_http_requests_total', 'counter', 'HTTP requests served, by route and status code.')
+metrics.define('wol_http_request_duration_seconds', 'histogram', 'Time spent serving a request, by route.',
+               METRICS_LATENCY_BUCKETS)
+metrics.define('wol_probes_total', 'counter', 'Background reachability probes, by result (up/down).')
+metrics.define('wol_probe_success_ratio', 'gauge', 'Share of background probes that got an answer.')
+metrics.define('wol_probe_rtt_seconds', 'histogram', 'Round-trip time of answered probes, by method.',
+               METRICS_LATENCY_BUCKETS)
+metrics.define('wol_device_up', 'gauge', 'Whether the last probe of a device got an answer.')
+metrics.define('wol_presence_checks_total', 'counter',
+               'Device checks, by source: the neighbour table alone, or an active probe.')
+metrics.define('wol_device_mac_mismatch', 'gauge', "Whether a device's IP answers with another MAC (DHCP change).")
+metrics.define('wol_magic_packets_total', 'counter', 'Magic packets sent.')
+metrics.define('wol_magic_packet_errors_total', 'counter', 'Magic packets that failed to send.')
+metrics.define('wol_wol_batch_duration_seconds', 'histogram', 'Duration of magic packet batches, pacing included.',
+               METRICS_LATENCY_BUCKETS)
+metrics.define('wol_gpio_press_duration_seconds', 'histogram', 'How long the power button pin was held low.',
+               (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+metrics.define('wol_safety_timer_expirations_total', 'counter', 'Presses released by the safety timer.')
+metrics.define('wol_coalesced_requests_total', 'counter', 'Actions that joined an identical one already running, by action.')
+metrics.define('wol_rate_limited_total', 'counter', 'Actions refused with 429, by scope (client/device).')
+metrics.define('wol_auth_verify_seconds', 'histogram', "Time spent checking a request's token, by cache (hit/miss).",
+               (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001))
+metrics.define('wol_auth_failures_total', 'counter', 'Requests refused by authentication, by reason.')
+metrics.define('wol_job_runs_total', 'counter', 'Scheduled jobs run, by outcome (ok/partial/timeout/error/rate_limited/missed).')
+metrics.define('wol_event_clients', 'gauge', 'Connected /events streams.')
+metrics.define('wol_http_rejected_connections_total', 'counter',
+               'Connections refused on accept, by reason (client: too many open from one address, 429; busy: no worker free, 503).')
+
+class EventBroker:
+    """Fans server-side events out to every connected /events client.
+
+    Each subscriber gets its own bounded queue; a client too slow to drain it is
+    dropped rather than allowed to hold events back for everyone else.
+    """
+
+    def __init__(self, max_clients=MAX_EVENT_CLIENTS):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        """Register a new client. Returns its queue, or None if the server is at capacity."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+            self._subscribers.add(subscriber)
+            metrics.set('wol_event_clients', len(self._subscribers))
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            metrics.set('wol_event_clients', len(self._subscribers))
+
+    def publish(self, event, data):
+        """Queue an event for every client. Never blocks."""
+        message = (event, json.dumps(data))
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # The client stopped reading: drop its backlog and tell its stream to close
+                self.unsubscribe(subscriber)
+                while True:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        break
+                subscriber.put_nowait(None)
+
+events = EventBroker()
+
+# --- State history ---
+HISTORY_KINDS = ('status', 'wol', 'press')
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+class HistoryStore:
+    """Memory-bounded ring of state events, mirrored to an append-only file.
+
+    Every event is one slot in a handful of preallocated typed arrays, so the
+    ring costs ~16 bytes per event however long the server runs. Device ids
+    are interned; index 0 stands for events that concern no device.
+    Events are (at, kind, device, value, amount): value is 1/0 for up/down or
+    sent/failed (-1 when meaningless), amount the RTT, packet count or press
+    duration in ms (NaN when unknown).
+    """
+
+    def __init__(self, path=HISTORY_FILE, size=HISTORY_SIZE):
+        if size < 1:
+            raise ValueError(f"history size must be at least 1, not {size!r}")
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._at = array('d', bytes(8 * size))
+        self._kind = array('B', bytes(size))
+        self._device = array('H', bytes(2 * size))
+        self._value = array('b', bytes(size))
+        self._amount = array('f', bytes(4 * size))
+        self._count = 0
+        self._next = 0  # Slot the next event goes into
+        self._device_ids = ['']
+        self._device_index = {'': 0}
+        self._pending = []  # Lines not yet appended to the file
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, kind, device_id=None, value=None, amount=None, at=None):
+        at = time.time() if at is None else at
+        value = -1 if value is None else int(value)
+        amount = math.nan if amount is None else float(amount)
+        with self._lock:
+            self._store(at, kind, device_id or '', value, amount)
+            if self.path:
+                self._pending.append(f"{at:.3f}\t{kind}\t{device_id or ''}\t{value}\t{amount:g}\n")
+
+    def _store(self, at, kind, device_id, value, amount):
+        """Write one event into the ring. Call with the lock held."""
+        index = self._device_index.get(device_id)
+        if index is None:
+            if len(self._device_ids) > 0xFFFF:
+                return
+            index = self._device_index[device_id] = len(self._device_ids)
+            self._device_ids.append(device_id)
+        slot = self._next
+        self._at[slot] = at
+        self._kind[slot] = HISTORY_KINDS.index(kind)
+        self._device[slot] = index
+        self._value[slot] = value
+        self._amount[slot] = amount
+        self._next = (slot + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def _events(self):
+        """Every stored event, oldest first. Call with the lock held."""
+        start = (self._next - self._count) % self.size
+        for offset in range(self._count):
+            slot = (start + offset) % self.size
+            yield (self._at[slot], HISTORY_KINDS[self._kind[slot]], self._device_ids[self._device[slot]],
+                   self._value[slot], self._amount[slot])
+
+    def load(self):
+        """Refill the ring from the tail of the history file, skipping lines it cannot parse."""
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                lines = deque(f, maxlen=self.size)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            for line in lines:
+                try:
+                    at, kind, device_id, value, amount = line.rstrip('\n').split('\t')
+                    self._store(float(at), kind, device_id, int(value), float(amount))
+                except ValueError:
+                    continue  # A line cut short by a power loss
+
+    def flush(self):
+        """Append pending events to the file, compacting it once it gets too big."""
+        with self._lock:
+            lines, self._pending = self._pending, []
+        if not self.path or not lines:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.writelines(lines)
+            if os.path.getsize(self.path) > HISTORY_FILE_MAX_BYTES:
+                self._compact()
+        except OSError as e:
+            print(f"⚠️ Could not write history to {self.path}: {e}")
+
+    def _compact(self):
+        """Rewrite the file with just the events still in the ring."""
+        with self._lock:
+            lines = [f"{at:.3f}\t{kind}\t{device_id}\t{value}\t{amount:g}\n"
+                     for at, kind, device_id, value, amount in self._events()]
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.writelines(lines)
+        os.replace(temporary, self.path)
+
+    def start(self):
+        self.load()
+        self._thread = threading.Thread(target=self._loop, name='history-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _loop(self):
+        while not self._stop.wait(HISTORY_FLUSH_INTERVAL):
+            self.flush()
+
+    def query(self, since, until, device_id=None, points=100):
+        """Events between since and until (wall-clock seconds), plus points downsampled buckets.
+
+        Each bucket holds the share of its time the device(s) were up (None when
+        nothing was known yet) and how many magic packets and presses fell in it.
+        Raw events are capped at points; the most recent are kept.
+        """
+        with self._lock:
+            events = [event for event in self._events()
+                      if device_id is None or event[2] in (device_id, '')]
+        width = (until - since) / points
+        up, known = [0.0] * points, [0.0] * points
+        counts = {'wol': [0] * points, 'press': [0] * points}
+        # A device's state holds from one status event to the next, so state set before since still counts
+        transitions = {}
+        for at, kind, event_device, value, _ in events:
+            if kind == 'status' and at < until:
+                transitions.setdefault(event_device, []).append((at, value == 1))
+            elif kind in counts and since <= at < until:
+                counts[kind][min(points - 1, int((at - since) / width))] += 1
+        for changes in transitions.values():
+            # The latest state lasts until now, not into the future
+            for (start, alive), (end, _) in zip(changes, changes[1:] + [(min(until, time.time()), None)]):
+                start, end = max(start, since), min(end, until)
+                bucket = int((start - since) / width)
+                while start < end and bucket < points:
+                    overlap = min(end, since + (bucket + 1) * width) - start
+                    known[bucket] += overlap
+                    if alive:
+                        up[bucket] += overlap
+                    start += overlap
+                    bucket += 1
+        matching = [event for event in events if since <= event[0] < until]
+        return {
+            'since': since,
+            'until': until,
+            'device': device_id,
+            'bucket_seconds': round(width, 3),
+            'buckets': [{'start': round(since + index * width, 3),
+                         'uptime': round(up[index] / known[index], 4) if known[index] else None,
+                         'wol': counts['wol'][index], 'press': counts['press'][index]}
+                        for index in range(points)],
+            'events': [{'at': at, 'kind': kind, 'device': event_device or None,
+                        'value': None if value < 0 else value,
+                        'amount': None if math.isnan(amount) else round(amount, 3)}
+                       for at, kind, event_device, value, amount in matching[-points:]],
+            'truncated': len(matching) > points,
+        }
+
+def parse_time(value, now):
+    """Read a /history time: a Unix timestamp, or a duration ago such as 90s, 30m, 24h or 7d."""
+    value = value.strip()
+    if value[-1:] in _DURATION_UNITS:
+        result = now - float(value[:-1]) * _DURATION_UNITS[value[-1]]
+    else:
+        result = float(value)
+    if not math.isfinite(result):
+        raise ValueError(f"Invalid time: {value!r}")
+    return result
+
+history = HistoryStore()
+pin_pressed = False
+pin_pressed_at = None  # time.monotonic() of the current press, for the press duration metric
+
+def _record_release():
+    """Observe the duration of the press that just ended. Call with gpio_lock held."""
+    global pin_pressed_at
+    if pin_pressed_at is not None:
+        duration = time.monotonic() - pin_pressed_at
+        metrics.observe('wol_gpio_press_duration_seconds', duration)
+        history.record('press', amount=duration * 1000)
+        pin_pressed_at = None
+
+class SafetyTimer:
+    """A re-armable one-shot timer served by a single long-lived thread.
+
+    arm() and cancel() only move a deadline under a condition variable, so a
+    burst of presses never creates (or leaves behind) a thread per press.
+    Every arm() or cancel() bumps a generation; the callback receives the
+    generation it fired for and can tell whether it was overtaken since.
+    """
+
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self._callback = callback
+        self._cond = threading.Condition()
+        self._deadline = None
+        self._generation = 0
+        self._thread = None
+
+    @property
+    def generation(self):
+        with self._cond:
+            return self._generation
+
+    def arm(self):
+        """(Re)start the countdown."""
+        with self._cond:
+            self._generation += 1
+            self._deadline = time.monotonic() + self.delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='safety-timer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel(self):
+        with self._cond:
+            self._generation += 1
+            self._deadline = None
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._deadline is None or self._deadline > time.monotonic():
+                    self._cond.wait(None if self._deadline is None else self._deadline - time.monotonic())
+                self._deadline = None
+                generation = self._generation
+            # Called without the condition held, so the callback may take gpio_lock and re-arm
+            self._callback(generation)
+
+def reset_pin_high(generation):
+    """Safety function to release the pin (high impedance) after PIN_SAFETY_TIMEOUT seconds."""
+    global pin_pressed
+    with gpio_lock:
+        # A press or release that arrived while the timer was firing overtook it; leave it alone
+        if safety_timer.generation != generation:
+            return
+        if gpio:
+            try:
+                gpio.release()
+                print(f"Safety timeout: Pin {HW_PIN} automatically released.")
+            except Exception as e:
+                print(f"Error resetting pin: {e}")
+        pin_pressed = False
+        _record_release()
+    metrics.inc('wol_safety_timer_expirations_total')
+    events.publish('pin', {'pressed': False, 'source': 'safety-timeout'})
+
+safety_timer = SafetyTimer(PIN_SAFETY_TIMEOUT, reset_pin_high)
+
+def _sleep_until(deadline):
+    """Wait for a perf_counter() deadline: sleep for the bulk, spin for the last PIN_SPIN_MARGIN."""
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        if remaining > PIN_SPIN_MARGIN:
+            time.sleep(remaining - PIN_SPIN_MARGIN)
+        else:
+            time.sleep(0)  # Yield to other threads while spinning
+
+class PressEngine:
+    """Runs timed presses (pulse/hold) on one dedicated timing thread.
+
+    The press and release happen server-side, so their spacing no longer
+    depends on network jitter between two HTTP requests. One press runs at a
+    time; a manual press or another timed press is refused while it does,
+    and only abort() ends it early.
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._busy = threading.Lock()
+        self._aborted = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def busy(self):
+        return self._busy.locked()
+
+    def abort(self):
+        """Wake the timing thread of a running press; call after releasing the line under gpio_lock."""
+        self._aborted.set()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='gpio-timing', daemon=True)
+                self._thread.start()
+
+    def press_for(self, seconds, source):
+        """Press the button for seconds and block until released.
+
+        Returns the timing report. Raises RuntimeError if the button is
+        already being pressed.
+        """
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("A timed press is already in progress")
+        try:
+            self.start()
+            job = {'seconds': seconds, 'source': source, 'done': threading.Event()}
+            self._jobs.put(job)
+            job['done'].wait()
+            if 'error' in job:
+                raise job['error']
+            return job['result']
+        finally:
+            self._busy.release()
+
+    def _loop(self):
+        _raise_thread_priority()
+        while True:
+            job = self._jobs.get()
+            try:
+                job['result'] = self._run(job['seconds'], job['source'])
+            except Exception as e:
+                job['error'] = e
+            job['done'].set()
+
+    def _run(self, seconds, source):
+        global pin_pressed, pin_pressed_at
+        with gpio_lock:
+            if pin_pressed:
+                raise RuntimeError("The button is already pressed")
+            self._aborted.clear()
+            gpio.press()
+            pressed = time.perf_counter()
+            pin_pressed = True
+            pin_pressed_at = time.monotonic()
+        events.publish('pin', {'pressed': True, 'source': source})
+        # Wait for the bulk of the press on the event, so an abort returns at once; spin for the rest
+        if not self._aborted.wait(max(0.0, pressed + seconds - PIN_SPIN_MARGIN - time.perf_counter())):
+            _sleep_until(pressed + seconds)
+        with gpio_lock:
+            if not pin_pressed:
+                # /pin/abort always wins, so a hold can be cut short; its duration is then meaningless
+                raise RuntimeError("The press was aborted by /pin/abort")
+            gpio.release()
+            released = time.perf_counter()
+            pin_pressed = False
+            _record_release()
+        events.publish('pin', {'pressed': False, 'source': source})
+        achieved = released - pressed
+        return {
+            'requested_ms': round(seconds * 1000, 3),
+            'achieved_ms': round(achieved * 1000, 3),
+            'error_ms': round((achieved - seconds) * 1000, 3),
+        }
+
+def _raise_thread_priority():
+    """Best effort: give the calling thread real-time (or at least higher) scheduling priority."""
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(os.sched_get_priority_min(os.SCHED_FIFO)))
+        return
+    except (AttributeError, OSError):
+        pass
+    try:
+        # Lowering niceness needs privileges too; without them the thread simply keeps its priority
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), -10)
+    except (AttributeError, OSError):
+        pass
+
+press_engine = PressEngine()
+
+# --- Native prober ---
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+_icmp_socket_kind = None  # Cached socket type that worked, or False if ICMP is unavailable
+_icmp_seq = 0
+_icmp_seq_lock = threading.Lock()
+
+def _icmp_checksum(data):
+    """Standard internet checksum (RFC 1071)."""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+def _open_icmp_socket():
+    """Open an ICMP socket, preferring the unprivileged datagram kind. Returns None if unavailable."""
+    global _icmp_socket_kind
+    if _icmp_socket_kind is False:
+        return None
+    kinds = (_icmp_socket_kind,) if _icmp_socket_kind else (socket.SOCK_DGRAM, socket.SOCK_RAW)
+    for kind in kinds:
+        try:
+            sock = socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+        except OSError:
+            continue
+        _icmp_socket_kind = kind
+        return sock
+    _icmp_socket_kind = False
+    return None
+
+def probe_icmp_many(ips, timeout=None):
+    """Sweep a list of IPs with one ICMP socket: all echo requests go out at once.
+
+    Returns {ip: rtt_seconds} for every host that replied within timeout.
+    Raises OSError if ICMP sockets cannot be opened on this system.
+    """
+    global _icmp_seq
+    timeout = PROBE_TIMEOUT if timeout is None else timeout
+    sock = _open_icmp_socket()
+    if sock is None:
+        raise OSError('ICMP sockets are not permitted')
+    raw = sock.type == socket.SOCK_RAW
+    ident = os.getpid() & 0xFFFF
+    pending = {}  # (ip, seq) -> send time
+    rtts = {}
+    try:
+        for ip in ips:
+            with _icmp_seq_lock:
+                _icmp_seq = (_icmp_seq + 1) & 0xFFFF
+                seq = _icmp_seq
+            payload = struct.pack('!d', time.monotonic()) + b'wol_on_http'
+            header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+            checksum = _icmp_checksum(header + payload)
+            packet = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, ident, seq) + payload
+            try:
+                sock.sendto(packet, (ip, 0))
+            except OSError:
+                continue  # Unroutable address: the other methods get their chance
+            pending[(ip, seq)] = time.monotonic()
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not select.select([sock], [], [], remaining)[0]:
+                break
+            data, addr = sock.recvfrom(1024)
+            if raw:
+                # Raw sockets deliver the IP header too
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, reply_ident, reply_seq = struct.unpack('!BBHHH', data[:8])
+            # The kernel rewrites the identifier on datagram sockets, so only raw replies are matched on it
+            if icmp_type != ICMP_ECHO_REPLY or (raw and reply_ident != ident):
+                continue
+            sent_at = pending.pop((addr[0], reply_seq), None)
+            if sent_at is not None:
+                rtts[addr[0]] = time.monotonic() - sent_at
+    finally:
+        sock.close()
+    return rtts
+
+def probe_icmp(ip, timeout=None):
+    """Send one ICMP echo request. Returns the RTT in seconds, or None if no reply arrived.
+
+    Raises OSError if ICMP sockets cannot be opened on this system.
+    """
+    return probe_icmp_many([ip], timeout).get(ip)
+
+def probe_tcp(ip, ports=None, timeout=None):
+    """Try a TCP connect to every port at once. Returns the RTT in seconds of the first answer, or None.
+
+    The connects share one deadline of timeout seconds, so a silent host costs
+    timeout, not timeout per port. A refused connection counts as an answer:
+    the host had to be up to send the RST.
+    """
+    ports = PROBE_TCP_PORTS if ports is None else ports
+    timeout = PROBE_TIMEOUT if timeout is None else timeout
+    started = time.monotonic()
+    deadline = started + timeout
+    connecting = []
+    try:
+        for port in ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            connecting.append(sock)
+            sock.setblocking(False)
+            code = sock.connect_ex((ip, port))
+            if code in (0, errno.ECONNREFUSED):
+                return time.monotonic() - started
+            if code not in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                connecting.remove(sock)
+                sock.close()  # Unroutable: every port will say the same
+        waiting = list(connecting)
+        while waiting:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ready = select.select([], waiting, [], remaining)[1]
+            for sock in ready:
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) in (0, errno.ECONNREFUSED):
+                    return time.monotonic() - started
+                waiting.remove(sock)
+        return None
+    finally:
+        for sock in connecting:
+            sock.close()
+
+def probe_arp(ip, neighbours=None):
+    """Return True if the kernel neighbour table holds a fresh (REACHABLE) entry for ip.
+
+    A complete but stale entry only says the host answered at some point in the
+    last minutes, e.g. just before it shut down, so it does not count.
+    neighbours is a table already read by read_neighbours(); without it the table is read here.
+    """
+    entry = ((read_neighbours() if neighbours is None else neighbours) or {}).get(ip)
+    return bool(entry and entry[0] and entry[1])
+
+# Neighbour table (netlink RTM_GETNEIGH dump, with /proc/net/arp as the fallback)
+RTM_NEWNEIGH, RTM_GETNEIGH = 28, 30
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+NLM_F_REQUEST_DUMP = 0x301  # NLM_F_REQUEST | NLM_F_DUMP
+NDA_DST, NDA_LLADDR = 1, 2
+NUD_REACHABLE = 0x02
+
+def _mac_digits(mac):
+    """A MAC address as 12 lowercase hex digits, whatever separators it was written with."""
+    return re.sub(r'[^0-9a-f]', '', mac.lower())
+
+def _read_neighbours_netlink():
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE) as sock:
+        sock.settimeout(1.0)
+        request = struct.pack('=BxxxiHBB', socket.AF_INET, 0, 0, 0, 0)  # struct ndmsg
+        sock.send(struct.pack('=IHHII', 16 + len(request), RTM_GETNEIGH, NLM_F_REQUEST_DUMP, 1, 0) + request)
+        table = {}
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + 16 <= len(data):
+                length, kind = struct.unpack_from('=IH', data, offset)
+                if kind == NLMSG_DONE:
+                    return table
+                if kind == NLMSG_ERROR:
+                    raise OSError(-struct.unpack_from('=i', data, offset + 16)[0], "netlink neighbour dump failed")
+                if kind == RTM_NEWNEIGH and length >= 28:
+                    state = struct.unpack_from('=H', data, offset + 24)[0]
+                    ip = mac = None
+                    position, end = offset + 28, offset + length
+                    while position + 4 <= end:
+                        attr_length, attr_type = struct.unpack_from('=HH', data, position)
+                        if attr_length < 4:
+                            break
+                        value = data[position + 4:position + attr_length]
+                        if attr_type == NDA_DST and len(value) == 4:
+                            ip = socket.inet_ntoa(value)
+                        elif attr_type == NDA_LLADDR and len(value) == 6 and any(value):
+                            mac = value.hex()
+                        position += (attr_length + 3) & ~3
+                    if ip:
+                        table[ip] = (mac, bool(state & NUD_REACHABLE))
+                if length < 16:
+                    break
+                offset += (length + 3) & ~3
+
+def _read_neighbours_proc():
+    table = {}
+    with open('/proc/net/arp') as f:
+        next(f, None)  # Skip the header line
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 4:
+                # ATF_COM (0x2) marks a resolved entry
+                resolved = int(fields[2], 16) & 0x2 and fields[3] != '00:00:00:00:00:00'
+                table[fields[0]] = (_mac_digits(fields[3]) if resolved else None, False)
+    return table
+
+def read_neighbours():
+    """The kernel's IPv4 neighbour table in one pass: {ip: (mac digits or None, reachable)}.
+
+    reachable means the kernel confirmed the entry within its reachable time
+    (NUD_REACHABLE). /proc/net/arp does not tell, so through the fallback no
+    entry is reachable. Returns None when neither source can be read.
+    """
+    try:
+        return _read_neighbours_netlink()
+    except (OSError, AttributeError, struct.error):  # AttributeError: no AF_NETLINK outside Linux
+        pass
+    try:
+        return _read_neighbours_proc()
+    except (OSError, ValueError):
+        return None
+
+def probe_target(ip, methods=None, timeout=None, neighbours=None):
+    """Probe ip in-process with each method in turn (PROBE_METHODS by default).
+
+    Returns (alive, rtt_ms, method): rtt_ms is None when the method cannot measure it
+    (ARP) and method is None when nothing answered. neighbours is passed on to probe_arp.
+    """
+    methods = PROBE_METHODS if methods is None else methods
+    for method in methods:
+        try:
+            if method == 'icmp':
+                rtt = probe_icmp(ip, timeout)
+            elif method == 'tcp':
+                rtt = probe_tcp(ip, timeout=timeout)
+            elif method == 'arp':
+                if probe_arp(ip, neighbours):
+                    return True, None, 'arp'
+                continue
+            else:
+                continue
+        except OSError:
+            continue
+        if rtt is not None:
+            return True, round(rtt * 1000, 3), method
+    return False, None, None
+
+def probe_many(ips, methods=None, timeout=None, concurrency=None, neighbours=None, sweep_only=(), deadline=None):
+    """Probe many IPs at once. Returns {ip: (alive, rtt_ms, method)}.
+
+    A single ICMP sweep covers every host; only the ones that stay silent are
+    retried with the remaining methods, a bounded number at a time. IPs in
+    sweep_only get the sweep alone, and no retry starts after deadline (a
+    time.monotonic() value). The neighbour table is read at most once per
+    call, or not at all when the caller passes the one it already has.
+    """
+    methods = PROBE_METHODS if methods is None else methods
+    concurrency = PROBE_CONCURRENCY if concurrency is None else concurrency
+    pending = list(dict.fromkeys(ips))
+    results = {}
+    if 'icmp' in methods:
+        try:
+            rtts = probe_icmp_many(pending, timeout)
+        except OSError:
+            rtts = {}
+        for ip, rtt in rtts.items():
+            results[ip] = (True, round(rtt * 1000, 3), 'icmp')
+        pending = [ip for ip in pending if ip not in results]
+    pending = [ip for ip in pending if ip not in sweep_only]
+    fallback = tuple(method for method in methods if method != 'icmp')
+    if pending and 'arp' in fallback and neighbours is None:
+        neighbours = read_neighbours() or {}
+    if pending and fallback:
+        from concurrent.futures import ThreadPoolExecutor  # Pulls in logging; most sweeps never get here
+        def retry(ip):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False, None, None  # Out of time: counts as down until the next cycle
+            return probe_target(ip, fallback, timeout, neighbours)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(pending)), thread_name_prefix='probe') as pool:
+            for ip, result in zip(pending, pool.map(retry, pending)):
+                results[ip] = result
+    for ip in ips:
+        results.setdefault(ip, (False, None, None))
+    return results
+
+class ReachabilityMonitor:
+    """Probes every registered device on its own schedule and caches the latest results.
+
+    Request handlers never probe a target themselves: they read the cached
+    result, so /ping costs no probe at all no matter how many clients poll it.
+    """
+
+    def __init__(self, interval=PING_INTERVAL, stale_after=PING_STALE_AFTER):
+        self.interval = interval
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._devices = {}  # device id -> (IP, MAC digits)
+        # device id -> (alive, rtt_ms, method, checked_at, checked_mono, mac_mismatch); checked_at is wall-clock time
+        self._results = {}
+        self._first_result = threading.Event()
+        self._published_stale = {}  # device id -> the stale flag last published
+        self._down_cycles = {}  # device id -> consecutive cycles it was found down
+        self._stale_checked = 0.0  # time.monotonic() of the last publish_staleness() pass
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_devices(self, devices):
+        """Replace the set of monitored devices."""
+        with self._lock:
+            self._devices = {device.id: (device.ip, _mac_digits(device.mac)) for device in devices}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='reachability-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 2)
+
+    def probe_now(self):
+        """Check every device once and store the results.
+
+        One read of the neighbour table settles the devices the kernel heard
+        from recently; only the others are actively probed. Devices known to be
+        down only get the ICMP sweep between full retries, and no probe starts
+        once the cycle has run for its interval.
+        """
+        deadline = time.monotonic() + self.interval
+        with self._lock:
+            devices = dict(self._devices)
+        table = read_neighbours() if PRESENCE_NEIGHBOURS else None
+        results, mismatches, targets = self._presence(devices, table or {})
+        retry = {ip for device_id, ip in targets.items()
+                 if not self._down_cycles.get(device_id, 0) % PROBE_DOWN_RETRY_CYCLES}
+        probed = probe_many(set(targets.values()), neighbours=table, sweep_only=set(targets.values()) - retry,
+                            deadline=deadline) if targets else {}
+        for device_id, ip in targets.items():
+            results[device_id] = probed[ip]
+        checked_at, checked_mono = time.time(), time.monotonic()
+        flipped, moved = set(), set()
+        with self._lock:
+            for device_id, (alive, rtt_ms, method) in results.items():
+                previous = self._results.get(device_id)
+                mismatch = mismatches.get(device_id)
+                if previous is None or previous[0] != alive:
+                    flipped.add(device_id)
+                if (previous[5] if previous else None) != mismatch:
+                    moved.add(device_id)
+                self._results[device_id] = (alive, rtt_ms, method, checked_at, checked_mono, mismatch)
+                self._down_cycles[device_id] = 0 if alive else self._down_cycles.get(device_id, 0) + 1
+                if self._published_stale.pop(device_id, False):
+                    moved.add(device_id)  # Fresh again: dashboards were told it went stale
+        self._first_result.set()
+        if len(results) > len(targets):
+            metrics.inc('wol_presence_checks_total', len(results) - len(targets), source='neighbour')
+        if targets:
+            metrics.inc('wol_presence_checks_total', len(targets), source='probe')
+        for alive, rtt_ms, method in results.values():
+            metrics.inc('wol_probes_total', result='up' if alive else 'down')
+            if rtt_ms is not None:
+                metrics.observe('wol_probe_rtt_seconds', rtt_ms / 1000, method=method)
+        up, down = metrics.value('wol_probes_total', result='up'), metrics.value('wol_probes_total', result='down')
+        if up + down:
+            metrics.set('wol_probe_success_ratio', round(up / (up + down), 4))
+        for device_id, (alive, rtt_ms, method) in results.items():
+            metrics.set('wol_device_up', int(alive), device=device_id)
+            metrics.set('wol_device_mac_mismatch', int(device_id in mismatches), device=device_id)
+            if device_id in flipped:
+                history.record('status', device_id, alive, rtt_ms, at=checked_at)
+            if device_id in moved and device_id in mismatches:
+                mismatch = mismatches[device_id]
+                found = f"at {mismatch['mac_ip']}" if mismatch['mac_ip'] else 'not in the neighbour table'
+                print(f"⚠️ {device_id}: {devices[device_id][0]} answers as {mismatch['ip_mac'] or 'nobody'}, "
+                      f"and its MAC is {found}. Did its DHCP lease change?")
+            if device_id in flipped or device_id in moved:
+                events.publish('status', self.status(device_id))
+        return results
+
+    def publish_staleness(self):
+        """Publish a status event for every device whose result has just gone stale.
+
+        A cycle stuck on slow probes publishes nothing itself, so the event
+        streams call this while they wait; it does real work at most once a second.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._stale_checked < 1.0:
+                return
+            self._stale_checked = now
+            stale = [device_id for device_id, result in self._results.items()
+                     if device_id in self._devices and now - result[4] > self.stale_after
+                     and not self._published_stale.get(device_id)]
+            for device_id in stale:
+                self._published_stale[device_id] = True
+        for device_id in stale:
+            events.publish('status', self.status(device_id))
+
+    @staticmethod
+    def _presence(devices, neighbours):
+        """Settle what the neighbour table can.
+
+        Returns (results, mismatches, targets): the results of the devices
+        settled, MAC mismatches by device id, and for every other device the
+        IP that still needs an active probe.
+        """
+        by_mac = {mac: ip for ip, (mac, _) in neighbours.items() if mac}
+        results, mismatches, targets = {}, {}, {}
+        for device_id, (ip, mac) in devices.items():
+            seen, moved_to = neighbours.get(ip, (None, False))[0], by_mac.get(mac)
+            if PRESENCE_VERIFY_MAC and seen != mac and (seen or moved_to):
+                # Whatever answers at ip is not this device: follow its MAC if the kernel saw it elsewhere.
+                # Otherwise ip may still be right (a repeater, bridge or proxy-ARP answers for it), so probe it.
+                mismatches[device_id] = {'ip_mac': seen and ':'.join(re.findall('..', seen)), 'mac_ip': moved_to}
+                if moved_to is None:
+                    targets[device_id] = ip
+                    continue
+                ip = moved_to
+            if neighbours.get(ip, (None, False))[1]:
+                results[device_id] = (True, None, 'neighbour')
+            else:
+                targets[device_id] = ip
+        return results, mismatches, targets
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.probe_now()
+            # Keep a steady cadence regardless of how long the probe took
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def status(self, device_id, wait=0.0):
+        """Return a device's cached result as a dict, optionally waiting for the first probe."""
+        if wait:
+            self._first_result.wait(wait)
+        with self._lock:
+            result = self._results.get(device_id)
+        if result is None:
+            return {'device': device_id, 'alive': False, 'rtt_ms': None, 'method': None,
+                    'checked_at': None, 'age': None, 'stale': True, 'mac_mismatch': None}
+        alive, rtt_ms, method, checked_at, checked_mono, mismatch = result
+        age = time.monotonic() - checked_mono
+        return {
+            'device': device_id,
+            'alive': alive,
+            'rtt_ms': rtt_ms,
+            'method': method,
+            'checked_at': checked_at,
+            'age': round(age, 3),
+            'stale': age > self.stale_after,
+            'mac_mismatch': mismatch,
+        }
+
+monitor = ReachabilityMonitor()
+
+# --- Device registry ---
+MAC_PATTERN = re.compile(r'^[0-9A-Fa-f]{2}([:.-]?)[0-9A-Fa-f]{2}(\1[0-9A-Fa-f]{2}){4}$')
+
+class Device:
+    """A machine that can be woken and monitored."""
+
+    __slots__ = ('id', 'name', 'mac', 'ip', 'broadcast')
+
+    def __init__(self, device_id, name, mac, ip, broadcast):
+        self.id = device_id
+        self.name = name
+        self.mac = mac
+        self.ip = ip
+        self.broadcast = broadcast
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'mac': self.mac, 'ip': self.ip, 'broadcast': self.broadcast}
+
+def _slugify(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+def _device_from_entry(entry, index):
+    """Build a Device from one registry entry, raising ValueError if it is malformed."""
+    if not isinstance(entry, dict):
+        raise ValueError(f"device #{index + 1} must be an object")
+    mac, ip = str(entry.get('mac', '')), str(entry.get('ip', ''))
+    if not MAC_PATTERN.match(mac):
+        raise ValueError(f"device #{index + 1} has an invalid MAC address: {mac!r}")
+    if not ip:
+        raise ValueError(f"device #{index + 1} has no IP address")
+    name = str(entry.get('name') or ip)
+    device_id = _slugify(str(entry.get('id') or name)) or str(index + 1)
+    return Device(device_id, name, mac, ip, str(entry.get('broadcast') or BROADCAST_IP))
+
+DEVICES = {}
+
+def load_devices(path=None):
+    """Fill DEVICES from the JSON registry at path (DEVICES_FILE by default).
+
+    Without a registry the single device from the TARGET_* settings is used.
+    Raises ValueError for a malformed registry; DEVICES is left untouched then.
+    """
+    global DEVICES
+    path = DEVICES_FILE if path is None else path
+    if path:
+        with open(path) as f:
+            data = json.load(f)
+        entries = data.get('devices', []) if isinstance(data, dict) else data
+        if not isinstance(entries, list) or not entries:
+            raise ValueError(f"{path} does not contain any devices")
+        devices = {}
+        for index, entry in enumerate(entries):
+            device = _device_from_entry(entry, index)
+            if device.id in devices:
+                raise ValueError(f"duplicate device id {device.id!r} in {path}")
+            devices[device.id] = device
+    else:
+        device_id = _slugify(TARGET_ID or FRIENDLY_NAME) or 'default'
+        device = Device(device_id, FRIENDLY_NAME, TARGET_MAC, TARGET_IP, BROADCAST_IP)
+        devices = {device.id: device}
+    # Swapped in one assignment, so a concurrent request never sees a half-filled registry
+    DEVICES = devices
+    monitor.set_devices(DEVICES.values())
+    return DEVICES
+
+def primary_device():
+    """The device served by the legacy single-device routes (/wol, /ping) and the main card."""
+    if not DEVICES:
+        load_devices()
+    return next(iter(DEVICES.values()))
+
+# --- Magic packets ---
+@functools.lru_cache(maxsize=4096)
+def magic_packet(mac):
+    """The 102-byte payload for a MAC: six 0xFF bytes, then the address 16 times."""
+    digits = re.sub(r'[^0-9A-Fa-f]', '', mac)
+    if len(digits) != 12:
+        raise ValueError(f"Invalid MAC address: {mac!r}")
+    return b'\xff' * 6 + bytes.fromhex(digits) * 16
+
+class MagicPacketSender:
+    """Sends magic packets in paced batches over one persistent broadcast socket.
+
+    Each batch keeps its own pacing on the calling thread; the lock is only
+    held for a single send, so a long staggered batch never holds up another
+    wake-up.
+    """
+
+    def __init__(self, port=WOL_PORT):
+        self.port = port
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def _socket(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self._sock = sock
+        return self._sock
+
+    def _send(self, payload, address):
+        """Send one datagram over the shared socket; a socket that failed is dropped and reopened next time."""
+        with self._lock:
+            sock = self._socket()
+            try:
+                sock.sendto(payload, address)
+            except OSError:
+                # The socket may be broken (e.g. interface went away)
+                sock.close()
+                if self._sock is sock:
+                    self._sock = None
+                raise
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+
+    def send_batch(self, devices, repeat=None, spacing=None, stagger=None):
+        """Wake every device in order and report how the batch went (WOL_* pacing by default).
+
+        Returns {'devices': {id: {...}}, 'packets': n, 'errors': n, 'duration_ms': ms};
+        each device entry holds its status and when its first packet left,
+        relative to 'started', the time.monotonic() the batch began.
+        """
+        repeat = WOL_REPEAT if repeat is None else repeat
+        spacing = WOL_SPACING if spacing is None else spacing
+        stagger = WOL_STAGGER if stagger is None else stagger
+        # Offsets from the start of the batch, in send order
+        schedule = sorted(
+            (index * stagger + attempt * spacing, index, attempt)
+            for index in range(len(devices)) for attempt in range(repeat)
+        )
+        results = {device.id: {'status': 'ok', 'packets': 0, 'first_sent_ms': None} for device in devices}
+        packets = errors = 0
+        started = time.monotonic()
+        for offset, index, attempt in schedule:
+            device = devices[index]
+            result = results[device.id]
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self._send(magic_packet(device.mac), (device.broadcast, self.port))
+            except (OSError, ValueError) as e:
+                errors += 1
+                result['status'] = 'error'
+                result['message'] = str(e)
+                continue
+            packets += 1
+            result['packets'] += 1
+            if result['first_sent_ms'] is None:
+                result['first_sent_ms'] = round((time.monotonic() - started) * 1000, 3)
+        duration = time.monotonic() - started
+        metrics.inc('wol_magic_packets_total', packets)
+        if errors:
+            metrics.inc('wol_magic_packet_errors_total', errors)
+        metrics.observe('wol_wol_batch_duration_seconds', duration)
+        for device_id, result in results.items():
+            # A device counts as woken if at least one of its packets went out
+            if result['packets']:
+                result['status'] = 'ok'
+                result.pop('message', None)
+            history.record('wol', device_id, result['status'] == 'ok', result['packets'])
+        return {'devices': results, 'packets': packets, 'errors': errors, 'duration_ms': round(duration * 1000, 3),
+                'started': started}
+
+wol_sender = MagicPacketSender()
+
+def send_wol(device, **pacing):
+    """Wake a single device; raises OSError or ValueError if no packet could be sent."""
+    report = wol_sender.send_batch([device], **pacing)
+    result = report['devices'][device.id]
+    if result['status'] != 'ok':
+        raise OSError(result['message'])
+    return report
+
+def wait_until_online(device, sent_at, deadline):
+    """Probe device with exponential backoff until it answers or deadline passes.
+
+    sent_at and deadline are time.monotonic() values. Returns the wake latency in
+    seconds (first packet to first answer), or None if the device stayed silent.
+    The latency is only as precise as the backoff step at which the answer came.
+    """
+    interval = WAKE_PROBE_INITIAL
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            return None
+        time.sleep(min(interval, deadline - now))
+        alive, _, _ = probe_target(device.ip, timeout=min(PROBE_TIMEOUT, max(0.05, deadline - time.monotonic())))
+        if alive:
+            return time.monotonic() - sent_at
+        interval = min(interval * 2, WAKE_PROBE_MAX_INTERVAL)
+
+class WakeHistory:
+    """Rolling per-device record of how long wake-ups took."""
+
+    def __init__(self, size=WAKE_HISTORY_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = {}  # device id -> deque of (wall-clock time, latency_ms or None on timeout)
+
+    def record(self, device_id, latency):
+        entry = (time.time(), None if latency is None else round(latency * 1000, 1))
+        with self._lock:
+            self._entries.setdefault(device_id, deque(maxlen=self.size)).append(entry)
+
+    def summary(self, device_id):
+        """History plus statistics; trend_ms > 0 means recent wakes are slower than older ones."""
+        import statistics  # Imports decimal and fractions, so it is only loaded when asked for
+        with self._lock:
+            entries = list(self._entries.get(device_id, ()))
+        latencies = [latency for _, latency in entries if latency is not None]
+        summary = {
+            'device': device_id,
+            'wakes': [{'at': at, 'latency_ms': latency} for at, latency in entries],
+            'timeouts': len(entries) - len(latencies),
+            'median_ms': statistics.median(latencies) if latencies else None,
+            'min_ms': min(latencies, default=None),
+            'max_ms': max(latencies, default=None),
+            'trend_ms': None,
+        }
+        if len(latencies) >= 4:
+            half = len(latencies) // 2
+            summary['trend_ms'] = round(statistics.mean(latencies[-half:]) - statistics.mean(latencies[:half]), 1)
+        return summary
+
+wake_history = WakeHistory()
+
+# --- Rate limiting and coalescing ---
+class RateLimited(Exception):
+    """An action was refused by a rate limit; retry_after is in seconds."""
+
+    def __init__(self, retry_after, message):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class RateLimiter:
+    """Token buckets, one per key: rate tokens per second, holding at most burst.
+
+    Only the max_keys most recently used buckets are kept; a forgotten bucket
+    was idle long enough to have refilled anyway.
+    """
+
+    def __init__(self, rate, burst, max_keys=4096):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, time.monotonic() of the last update)
+
+    def acquire(self, key):
+        """Take a token for key. Returns 0 if allowed, else the seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / self.rate
+
+    def check(self, key, scope, message):
+        """Take a token for key or raise RateLimited."""
+        retry_after = self.acquire(key)
+        if retry_after:
+            metrics.inc('wol_rate_limited_total', scope=scope)
+            raise RateLimited(retry_after, message)
+
+class SingleFlight:
+    """Lets concurrent identical actions share one execution and its outcome.
+
+    The first caller for a key runs the action; callers arriving while it runs
+    wait and get the same result (or exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> {'done': Event, 'result' or 'error'}
+
+    def do(self, key, action):
+        """Run action() once for every concurrent caller with key. Returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event()}
+        if leader:
+            try:
+                call['result'] = action()
+            except Exception as e:
+                call['error'] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call['done'].set()
+        else:
+            metrics.inc('wol_coalesced_requests_total', action=key[0])
+            call['done'].wait()
+        if 'error' in call:
+            raise call['error']
+        return call['result'], not leader
+
+client_limiter = RateLimiter(ACTION_RATE, ACTION_BURST)
+device_limiter = RateLimiter(DEVICE_RATE, DEVICE_BURST)  # Keyed ('device', id) and ('button',)
+actions = SingleFlight()
+
+def wake_device(device, wait=0.0, **pacing):
+    """Wake device and, with wait, wait for it to answer. Returns the /wol response body.
+
+    Raises RateLimited when the device is woken too often, and OSError or
+    ValueError when no packet could be sent.
+    """
+    device_limiter.check(('device', device.id), 'device', f"{device.name} was woken too recently")
+    # A device that is already up would report a meaningless zero latency
+    already_online = wait and monitor.status(device.id)['alive']
+    try:
+        report = send_wol(device, **pacing)
+    except Exception as e:
+        events.publish('wol', {'device': device.id, 'status': 'error', 'message': str(e)})
+        raise
+    events.publish('wol', {'device': device.id, 'status': 'ok'})
+    result = {"status": "ok", "message": "Magic Packet sent successfully.",
+              "packets": report['packets'], "duration_ms": report['duration_ms']}
+    if wait and already_online:
+        result["online"] = True
+        result["message"] = "Magic Packet sent; the device was already online."
+    elif wait:
+        # first_sent_ms counts from when this batch started sending, not from when it was asked for
+        sent_at = report['started'] + report['devices'][device.id]['first_sent_ms'] / 1000
+        latency = wait_until_online(device, sent_at, sent_at + wait)
+        wake_history.record(device.id, latency)
+        result["online"] = latency is not None
+        result["wake_latency_ms"] = None if latency is None else round(latency * 1000, 1)
+        if latency is None:
+            result["status"] = "timeout"
+            result["message"] = f"Magic Packet sent, but the device did not answer within {wait:g}s."
+        events.publish('wake', {'device': device.id, 'online': result["online"],
+                                'wake_latency_ms': result["wake_latency_ms"]})
+    return result
+
+def parse_pacing(query, device_count=1):
+    """Read repeat, spacing_ms and stagger_ms overrides. Raises ValueError when out of range."""
+    pacing = {
+        'repeat': int(query.get('repeat', [WOL_REPEAT])[0]),
+        'spacing': float(query['spacing_ms'][0]) / 1000 if 'spacing_ms' in query else WOL_SPACING,
+        'stagger': float(query['stagger_ms'][0]) / 1000 if 'stagger_ms' in query else WOL_STAGGER,
+    }
+    if not 1 <= pacing['repeat'] <= WOL_MAX_REPEAT:
+        raise ValueError(f"repeat must be between 1 and {WOL_MAX_REPEAT}")
+    if not (0 <= pacing['spacing'] < math.inf and 0 <= pacing['stagger'] < math.inf):
+        raise ValueError("spacing_ms and stagger_ms must be non-negative numbers")
+    planned = (device_count - 1) * pacing['stagger'] + (pacing['repeat'] - 1) * pacing['spacing']
+    if planned > WOL_MAX_BATCH_SECONDS:
+        raise ValueError(f"Batch would take {planned:.0f}s; the limit is {WOL_MAX_BATCH_SECONDS:.0f}s")
+    return pacing
+
+def plan_wol(device, query):
+    """Validate a /wol query. Returns (key, action): the coalescing key and the call that wakes device.
+
+    Raises ValueError for a bad query; nothing is sent until action() is called.
+    """
+    pacing = parse_pacing(query)
+    wait = float(query['wait'][0]) if 'wait' in query else 0.0
+    if not 0 <= wait <= WAKE_MAX_WAIT:
+        raise ValueError(f"wait must be between 0 and {WAKE_MAX_WAIT:g} seconds")
+    # Identical requests arriving while this one runs (double clicks, several dashboards) share it
+    key = ('wol', device.id, wait, *sorted(pacing.items()))
+    return key, lambda: wake_device(device, wait, **pacing)
+
+def plan_wol_bulk(query):
+    """Validate a /wol/bulk query (ids=a,b,c or ids=all). Returns (key, action) like plan_wol."""
+    ids = [device_id for value in query.get('ids', []) for device_id in value.split(',') if device_id]
+    if ids == ['all']:
+        ids = list(DEVICES)
+    unknown = [device_id for device_id in ids if device_id not in DEVICES]
+    if not ids or unknown:
+        raise ValueError(f"Unknown devices: {', '.join(unknown)}" if unknown else "No devices selected")
+    devices = [DEVICES[device_id] for device_id in dict.fromkeys(ids)]
+    pacing = parse_pacing(query, len(devices))
+    key = ('bulk', tuple(device.id for device in devices), *sorted(pacing.items()))
+    return key, lambda: wake_batch(devices, pacing)
+
+def wake_batch(devices, pacing):
+    """Send one batch to every device not over its rate limit. Raises RateLimited if none is left."""
+    allowed, limited = [], {}
+    for device in devices:
+        retry_after = device_limiter.acquire(('device', device.id))
+        if retry_after:
+            limited[device.id] = retry_after
+        else:
+            allowed.append(device)
+    if limited:
+        metrics.inc('wol_rate_limited_total', len(limited), scope='device')
+    if not allowed:
+        raise RateLimited(min(limited.values()), "Every selected device was woken too recently")
+    report = wol_sender.send_batch(allowed, **pacing)
+    results = report['devices']
+    for device_id, result in results.items():
+        events.publish('wol', {'device': device_id, **result})
+    for device_id, retry_after in limited.items():
+        results[device_id] = {'status': 'rate_limited', 'packets': 0, 'first_sent_ms': None,
+                              'retry_after': math.ceil(retry_after)}
+    failed = sum(1 for result in results.values() if result["status"] == "error")
+    skipped = len(limited)
+    status = "ok" if not failed and not skipped else ("error" if failed == len(results) else "partial")
+    return {"status": status, "sent": len(results) - failed - skipped, "failed": failed, "rate_limited": skipped,
+            "packets": report['packets'], "duration_ms": report['duration_ms'], "results": results}
+
+# --- Authentication ---
+AUTH_SCOPES = ('view', 'wake', 'power')
+SESSION_COOKIE = 'wol_session'
+
+class TokenAuthority:
+    """Issues and verifies API tokens: <scopes>.<expiry>.<nonce>.<signature>.
+
+    scopes is a '-'-joined subset of AUTH_SCOPES and expiry a unix time; the
+    signature is an HMAC-SHA256 of the rest with AUTH_SECRET, compared in
+    constant time. Tokens that verified are kept in an LRU cache of cache_size
+    entries, so a dashboard's steady stream of requests costs a dict lookup.
+    """
+
+    def __init__(self, cache_size=AUTH_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (secret, token) -> (scopes, expiry)
+
+    def issue(self, scopes, ttl):
+        """A new token granting scopes, valid for ttl seconds. Raises ValueError."""
+        scopes = sorted(set(scopes))
+        unknown = set(scopes) - set(AUTH_SCOPES)
+        if not AUTH_SECRET:
+            raise ValueError("AUTH_SECRET is not set")
+        if not scopes or unknown:
+            raise ValueError(f"scopes must be some of {', '.join(AUTH_SCOPES)}")
+        payload = f"{'-'.join(scopes)}.{int(time.time() + ttl)}.{os.urandom(6).hex()}"
+        return f"{payload}.{self._sign(AUTH_SECRET, payload)}"
+
+    def verify(self, token):
+        """The scopes token grants, or None when it is malformed, forged or expired."""
+        started = time.perf_counter()
+        # Keyed by secret too, so a token checked while the secret changes is never cached as valid
+        key = (AUTH_SECRET, token)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+        cache = 'hit' if entry is not None else 'miss'
+        if entry is None:
+            entry = self._check(*key)
+            if entry is not None and self.cache_size > 0:
+                with self._lock:
+                    self._cache[key] = entry
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+        metrics.observe('wol_auth_verify_seconds', time.perf_counter() - started, cache=cache)
+        if entry is None:
+            metrics.inc('wol_auth_failures_total', reason='invalid')
+            return None
+        scopes, expiry = entry
+        if expiry <= time.time():
+            metrics.inc('wol_auth_failures_total', reason='expired')
+            return None
+        return scopes
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def _sign(secret, payload):
+        digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def _check(self, secret, token):
+        payload, _, signature = token.rpartition('.')
+        parts = payload.split('.')
+        if not secret or len(parts) != 3 or not parts[1].isdigit():
+            return None
+        # Header values are latin-1 text; compare bytes so any input takes the constant-time path
+        if not hmac.compare_digest(self._sign(secret, payload).encode(), signature.encode('utf-8', 'replace')):
+            return None
+        return frozenset(parts[0].split('-')), int(parts[1])
+
+auth = TokenAuthority()
+
+def _route_scope(path, method='GET'):
+    """The token scope a request needs, or None for the public ones."""
+    if path in ('/login', '/logout') or path.startswith('/favicon'):
+        return None
+    if path.startswith('/jobs') and method != 'GET':
+        return 'wake'
+    if path.startswith('/pin/'):
+        return 'power'
+    if path in ('/wol', '/wol/bulk') or (path.startswith('/devices/') and path.rstrip('/').endswith('/wol')):
+        return 'wake'
+    return 'view'
+
+def _cookie(header, name):
+    """The value of cookie name in a Cookie header, or None."""
+    for pair in header.split(';'):
+        key, _, value = pair.strip().partition('=')
+        if key == name:
+            return value
+    return None
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>__TITLE__</title><link rel="icon" href="/favicon.svg" type="image/svg+xml">
+<style>body{font-family:sans-serif;background:#f0f2f5;display:flex;justify-content:center;align-items:center;min-height:100vh;margin:0}
+form{background:#fff;padding:2em;border-radius:8px;box-shadow:0 2px 8px rgba(0,0,0,.1);display:flex;flex-direction:column;gap:1em;width:20em}
+input,button{font-size:1em;padding:.6em;border-radius:4px;border:1px solid #ccc}button{background:#3498db;color:#fff;border:0;cursor:pointer}
+p{margin:0;color:#ea4c3c}</style></head>
+<body><form method="post" action="/login"><h2>__TITLE__</h2>__MESSAGE__
+<input type="password" name="token" placeholder="Access token" autocomplete="current-password" required autofocus>
+<button type="submit">Sign in</button></form></body></html>
+"""
+
+def render_login_page(message=''):
+    page = LOGIN_PAGE.replace('__MESSAGE__', f'<p>{escape(message)}</p>' if message else '')
+    return page.replace('__TITLE__', escape(FRIENDLY_NAME))
+
+# --- Scheduled jobs ---
+JOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+JOB_OPTIONS = ('wait', 'repeat', 'spacing_ms', 'stagger_ms')  # Passed on as /wol query parameters
+
+class CronSchedule:
+    """A five-field cron expression (minute hour day-of-month month day-of-week) in local time.
+
+    Fields take *, numbers, ranges (1-5), lists (1,15) and steps (*/15, 8-18/2);
+    day-of-week 0 and 7 are Sunday. As in cron, when both day fields are
+    restricted a day matching either one will do.
+    """
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+    ALIASES = {'@hourly': '0 * * * *', '@daily': '0 0 * * *', '@midnight': '0 0 * * *',
+               '@weekly': '0 0 * * 0', '@monthly': '0 0 1 * *', '@yearly': '0 0 1 1 *'}
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = self.ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron needs 5 fields (minute hour day month weekday): {expression!r}")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES))
+        self.weekdays = {day % 7 for day in weekdays}
+        self._either_day = not fields[2].startswith('*') and not fields[4].startswith('*')
+        self.next_after(time.time())  # Rejects expressions that never match, such as February 30
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            spec, slash, step = part.partition('/')
+            try:
+                if spec == '*':
+                    start, end = low, high
+                elif '-' in spec:
+                    start, end = (int(value) for value in spec.split('-', 1))
+                else:
+                    start = int(spec)
+                    end = high if slash else start
+                step = int(step) if slash else 1
+            except ValueError:
+                raise ValueError(f"invalid cron field {field!r}") from None
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"cron field {field!r} is outside {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment):
+        in_month = moment.day in self.days
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        return (in_month or in_week) if self._either_day else (in_month and in_week)
+
+    def next_after(self, timestamp):
+        """The first matching minute after timestamp, as a Unix time. Raises ValueError if none comes."""
+        from datetime import datetime, timedelta
+        moment = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=5 * 366)
+        # Skip whole months, days and hours that cannot match instead of testing every minute
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"cron {self.expression!r} never matches")
+
+def _job_time(spec, now):
+    """When a one-shot job is due: "at" a Unix time or local ISO 8601 time, or after a "delay" (seconds or 30m)."""
+    if 'delay' in spec:
+        delay = spec['delay']
+        if isinstance(delay, str) and delay[-1:] in _DURATION_UNITS:
+            delay = float(delay[:-1]) * _DURATION_UNITS[delay[-1]]
+        delay = float(delay)
+        if delay < 0:
+            raise ValueError("delay must not be negative")
+        at = now + delay
+    elif isinstance(spec['at'], str):
+        from datetime import datetime
+        try:
+            at = float(spec['at'])
+        except ValueError:
+            at = datetime.fromisoformat(spec['at']).timestamp()
+    else:
+        at = float(spec['at'])
+    if not math.isfinite(at):
+        raise ValueError("at must be a finite time")
+    return at
+
+class JobScheduler:
+    """Runs scheduled wake-ups without a thread per job.
+
+    Due times sit in a heap that a single timer thread sleeps on; each job that
+    comes due is handed to a pool of JOB_WORKERS threads, so one waiting for its
+    device to boot never holds back the next. Jobs are plain dicts, written to
+    path as JSON after every change and every run.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._cond = threading.Condition()
+        self._jobs = {}  # id -> job
+        self._heap = []  # (due, id); an entry is stale once the job is gone or its next_run moved
+        self._save_lock = threading.Lock()
+        self._thread = None
+        self._pool = None
+        self._stopping = False
+
+    def create(self, spec):
+        """Validate a job spec and schedule it. Returns the job.
+
+        Raises ValueError for an invalid spec and RuntimeError when the id is
+        taken or JOBS_MAX jobs are still pending.
+        """
+        now = time.time()
+        job = self._build(spec, now)
+        with self._cond:
+            if job['id'] in self._jobs:
+                raise RuntimeError(f"Job {job['id']} already exists")
+            if len(self._jobs) >= JOBS_MAX:
+                # Finished one-shot jobs only stay around to show their outcome; the oldest makes room
+                finished = [other for other in self._jobs.values() if other['next_run'] is None]
+                if not finished:
+                    raise RuntimeError(f"Too many jobs (the limit is {JOBS_MAX})")
+                del self._jobs[min(finished, key=lambda other: other['created'])['id']]
+            self._jobs[job['id']] = job
+            self._schedule(job)
+            snapshot = dict(job)
+        self.save()
+        return snapshot
+
+    def _build(self, spec, now):
+        if not isinstance(spec, dict):
+            raise ValueError("a job must be a JSON object")
+        unknown = set(spec) - {'id', 'name', 'devices', 'at', 'delay', 'cron', *JOB_OPTIONS}
+        if unknown:
+            raise ValueError(f"unknown job fields: {', '.join(sorted(unknown))}")
+        job_id = spec.get('id') or os.urandom(4).hex()
+        if not isinstance(job_id, str) or not JOB_ID_PATTERN.match(job_id):
+            raise ValueError("id may only hold up to 64 letters, digits, - and _")
+        # "primary" is resolved when the job runs, so a renamed main device keeps its jobs
+        devices = spec.get('devices', 'primary')
+        if isinstance(devices, str) and devices not in ('all', 'primary'):
+            devices = [devices]
+        if devices not in ('all', 'primary') and (not isinstance(devices, list) or not devices
+                                                  or not all(isinstance(device_id, str) for device_id in devices)):
+            raise ValueError('devices must be a device id, a list of them, "primary" or "all"')
+        options = {name: spec[name] for name in JOB_OPTIONS if name in spec}
+        if any(type(value) not in (int, float) for value in options.values()):
+            raise ValueError(f"{', '.join(JOB_OPTIONS)} must be numbers")
+        timing = [name for name in ('at', 'delay', 'cron') if name in spec]
+        if len(timing) != 1:
+            raise ValueError("a job needs exactly one of at, delay or cron")
+        job = {'id': job_id, 'name': str(spec.get('name') or job_id), 'devices': devices, 'options': options,
+               'created': now, 'next_run': None, 'runs': []}
+        if 'cron' in spec:
+            if not isinstance(spec['cron'], str):
+                raise ValueError("cron must be a string such as '55 1 * * *'")
+            job['cron'] = spec['cron']
+            job['next_run'] = CronSchedule(job['cron']).next_after(now)
+        else:
+            try:
+                job['at'] = job['next_run'] = _job_time(spec, now)
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid {timing[0]}: {spec[timing[0]]!r}") from None
+            if job['at'] < now - JOB_MISFIRE_GRACE:
+                raise ValueError("at is in the past")
+        self._plan(job)  # Same checks as the API, now rather than at 01:55
+        return job
+
+    @staticmethod
+    def _plan(job):
+        """The (key, action) that runs job through the /wol or /wol/bulk path. Raises ValueError."""
+        query = {name: [str(value)] for name, value in job['options'].items()}
+        devices = [primary_device().id] if job['devices'] == 'primary' else job['devices']
+        if devices != 'all' and len(devices) == 1:
+            if devices[0] not in DEVICES:
+                raise ValueError(f"Unknown devices: {devices[0]}")
+            return plan_wol(DEVICES[devices[0]], query)
+        if 'wait' in query:
+            raise ValueError("wait needs a single device")
+        return plan_wol_bulk({**query, 'ids': ['all' if devices == 'all' else ','.join(devices)]})
+
+    def _schedule(self, job):
+        """Queue job's next run; the caller holds the condition."""
+        if job['next_run'] is not None:
+            heapq.heappush(self._heap, (job['next_run'], job['id']))
+            self._cond.notify()
+
+    def remove(self, job_id):
+        """Delete a job; a run in progress finishes. Returns False if there was no such job."""
+        with self._cond:
+            removed = self._jobs.pop(job_id, None) is not None
+        if removed:
+            self.save()
+        return removed
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def list(self):
+        """Every job, the next due first and finished ones last."""
+        with self._cond:
+            jobs = [dict(job) for job in self._jobs.values()]
+        return sorted(jobs, key=lambda job: (job['next_run'] is None, job['next_run'] or job['created']))
+
+    def load(self):
+        """Restore the jobs saved in path; runs missed while the server was down are handled as late runs."""
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)['jobs']
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Could not load jobs from {self.path}: {e}")
+            return
+        with self._cond:
+            for job in saved:
+                try:
+                    if 'cron' in job:
+                        CronSchedule(job['cron'])
+                    if job['next_run'] is not None:
+                        job['next_run'] = float(job['next_run'])
+                    self._jobs[job['id']] = job
+                    self._schedule(job)
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"⚠️ Skipping a saved job that is not valid: {e}")
+
+    def save(self):
+        """Write every job to path, replacing the file in one step."""
+        if not self.path:
+            return
+        with self._cond:
+            data = json.dumps({'jobs': list(self._jobs.values())}, indent=1)
+        with self._save_lock:
+            try:
+                temporary = self.path + '.tmp'
+                with open(temporary, 'w') as f:
+                    f.write(data + '\n')
+                os.replace(temporary, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not save jobs to {self.path}: {e}")
+
+    def start(self):
+        self.load()
+        self._thread = threading.Thread(target=self._loop, name='job-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._pool:
+            self._pool.shutdown(wait=False)
+
+    def _is_stale(self, entry):
+        job = self._jobs.get(entry[1])
+        return job is None or job['next_run'] != entry[0]
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    while self._heap and self._is_stale(self._heap[0]):
+                        heapq.heappop(self._heap)
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    # Due times are wall-clock: look again at least once a minute in case the clock jumps
+                    self._cond.wait(min(60.0, self._heap[0][0] - now) if self._heap else 60.0)
+                due, job_id = heapq.heappop(self._heap)
+                job = self._jobs[job_id]
+                # Reschedule before running so the listing shows the next run; catching up is never attempted
+                job['next_run'] = CronSchedule(job['cron']).next_after(max(due, now)) if 'cron' in job else None
+                self._schedule(job)
+            if now - due > JOB_MISFIRE_GRACE:
+                self._finish(job, due, now, {"status": "missed", "message": f"Due {now - due:.0f}s ago"})
+                continue
+            if self._pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+            self._pool.submit(self._run, job, due)
+
+    def _run(self, job, due):
+        started = time.time()
+        try:
+            key, action = self._plan(job)
+            result, _ = actions.do(key, action)
+        except RateLimited as e:
+            result = {"status": "rate_limited", "message": str(e), "retry_after": round(e.retry_after, 3)}
         except Exception as e:
-            print(f"Error resetting pin: {e}")
-    safety_timer = None
+            result = {"status": "error", "message": str(e)}
+        self._finish(job, due, started, result)
+
+    def _finish(self, job, due, started, result):
+        """Keep the outcome of a run with its job, count it and tell the dashboards."""
+        run = {'due': due, 'started': started, 'duration_ms': round((time.time() - started) * 1000, 1),
+               'status': result['status'], 'result': result}
+        with self._cond:
+            # A new list, so snapshots handed out by get() and list() never change under their reader
+            job['runs'] = (job['runs'] + [run])[-JOB_RUNS_KEPT:]
+            next_run = job['next_run']
+        metrics.inc('wol_job_runs_total', status=result['status'])
+        events.publish('job', {'id': job['id'], 'status': result['status'], 'next_run': next_run})
+        print(f"⏰ Job {job['name']}: {result['status']}")
+        self.save()
+
+jobs = JobScheduler()
 
 # --- SVG Icons (used in JS and HTML) ---
 # Using simple placeholders as most icons will be embedded directly in the HTML/JS for dynamic control
 FAVICON_DEFAULT_SVG = b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100"><circle cx="50" cy="50" r="45" fill="#909090"/></svg>'
+# Status favicons (a monitor on a coloured disc) share one template; only the disc colour differs
+FAVICON_STATUS_TEMPLATE = (
+    "<svg xmlns='http://www.w3.org/2000/svg' xml:space='preserve' id='svg10' x='0' y='0' version='1.1' viewBox='0 0 64 64'><style id='style1' type='text/css'>.st1{opacity:.2}.st2{fill:#231f20}.st3{fill:#fff}</style><g id='Layer_1'><g id='g1'><circle id='circle1' cx='32' cy='32' r='32' fill='__COLOR__' fill-opacity='1'/></g>"
+    "<g id='g2' class='st1'><path id='path1' d='M44 52a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st2'/></g><g id='g3'><path id='path2' d='M44 50a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st3'/></g><g id='g4'><path id='path3' fill='#e0e0d1' d='M37 42s-1 6 3 6H24c4 0 3-6 3-6h10z'/></g>"
+    "<g id='g6' class='st1'><g id='g5'><path id='path4' d='M52 40a4 4 0 0 1-4 4H16a4 4 0 0 1-4-4V18a4 4 0 0 1 4-4h32a4 4 0 0 1 4 4v22z' class='st2'/></g></g><g id='g9'><g id='g7'><path id='path6' fill='#4f5d73' d='M16 40.5a2.5 2.5 0 0 1-2.5-2.5V16c0-1.4 1.1-2.5 2.5-2.5h32c1.4 0 2.5 1.1 2.5 2.5v22c0 1.4-1.1 2.5-2.5 2.5H16z'/></g>"
+    "<g id='g8'><path id='path7' d='M48 15c.6 0 1 .4 1 1v22c0 .6-.4 1-1 1H16c-.6 0-1-.4-1-1V16c0-.6.4-1 1-1h32m0-3H16a4 4 0 0 0-4 4v22a4 4 0 0 0 4 4h32a4 4 0 0 0 4-4V16a4 4 0 0 0-4-4z' class='st3'/></g></g><g id='g10' class='st1'><path id='polygon9' d='M50 39.9v-26H26.2l15 26z' class='st3'/></g></g></svg>"
+)
+FAVICON_STATUS_COLORS = {'online': '#2ecc71', 'offline': '#ea4c3c', 'checking': '#eaaf3c'}
+
+DEVICE_ACTIONS = ('ping', 'wol', 'wakes')  # The sub-resources of /devices/<id>
+
+def _route_label(path):
+    """Map a request path to a bounded set of metric labels (device ids and unknown paths are not labels)."""
+    if path in STATIC_ASSETS:
+        return '/' if path == '/' else '/static'
+    if path.startswith('/devices/'):
+        parts = path.rstrip('/').split('/')
+        if len(parts) == 3:
+            return '/devices/{id}'
+        if len(parts) == 4 and parts[3] in DEVICE_ACTIONS:
+            return f'/devices/{{id}}/{parts[3]}'
+        return 'other'
+    if path.startswith('/jobs/'):
+        return '/jobs/{id}'
+    if path in ('/wol', '/ping', '/wol/bulk', '/devices', '/events', '/metrics', '/history', '/jobs',
+                '/pin/low', '/pin/high', '/pin/pulse', '/pin/hold', '/pin/abort', '/login', '/logout'):
+        return path
+    return 'other'
 
 class RequestHandler(BaseHTTPRequestHandler):
     """Handles HTTP requests for the Wake-on-LAN server."""
 
+    # Persistent connections: every response must carry Content-Length (or close the connection)
+    protocol_version = 'HTTP/1.1'
+    # Socket timeout while waiting for the next request on an idle connection
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, the body waits ~40 ms for the client's delayed ACK
+    disable_nagle_algorithm = True
+
     def do_GET(self):
         """Handle GET requests."""
-        if self.path == '/':
-            self._serve_html(self.render_main_page())
-        elif self.path == '/wol':
-            self._send_wol()
-        elif self.path == '/ping':
-            self._check_ping()
-        elif self.path == '/favicon.svg':
-            self._serve_favicon()
-        elif self.path == '/pin/low':
+        self._dispatch(self._route)
+
+    def do_POST(self):
+        """Handle POST requests: the login and logout forms, and new jobs."""
+        self._dispatch(self._route_post)
+
+    def do_DELETE(self):
+        """Handle DELETE requests: removing jobs."""
+        self._dispatch(self._route_delete)
+
+    def _dispatch(self, route):
+        started = time.perf_counter()
+        self._status_code = None
+        url = urlsplit(self.path)
+        try:
+            if self._authorize(url.path):
+                route(url.path, parse_qs(url.query))
+            elif self.headers.get('Content-Length', '0') != '0':
+                self.close_connection = True  # The unread body would be taken for the next request
+        finally:
+            route = _route_label(url.path)
+            metrics.inc('wol_http_requests_total', route=route, code=str(self._status_code))
+            # An event stream lasts as long as the client stays, which says nothing about latency
+            if route != '/events':
+                metrics.observe('wol_http_request_duration_seconds', time.perf_counter() - started, route=route)
+
+    def end_headers(self):
+        # While connections wait for a worker, don't hold this one for a next request that may never come
+        if not self.close_connection and getattr(self.server, 'backlogged', False):
+            self.send_header('Connection', 'close')
+        super().end_headers()
+
+    def log_request(self, code='-', size='-'):
+        """Called by send_response: remember the status for metrics and sample the access log."""
+        self._status_code = code.value if hasattr(code, 'value') else code
+        if ACCESS_LOG_SAMPLE and random.random() < ACCESS_LOG_SAMPLE:
+            super().log_request(code, size)
+
+    def _route(self, path, query):
+        assets = STATIC_ASSETS or build_static_assets()
+        if path in assets:
+            self._serve_asset(assets[path])
+        elif path == '/wol':
+            self._send_wol(primary_device(), query)
+        elif path == '/ping':
+            self._check_ping(primary_device())
+        elif path == '/wol/bulk':
+            self._send_wol_bulk(query)
+        elif path == '/devices':
+            self._list_devices()
+        elif path.startswith('/devices/'):
+            self._handle_device(path, query)
+        elif path == '/events':
+            self._stream_events()
+        elif path == '/metrics':
+            self._send_response(200, 'text/plain; version=0.0.4; charset=utf-8', metrics.render())
+        elif path == '/history':
+            self._send_history(query)
+        elif path == '/jobs':
+            self._send_response(200, 'application/json', json.dumps({"jobs": jobs.list()}))
+        elif path.startswith('/jobs/'):
+            job = jobs.get(path[len('/jobs/'):])
+            if job is None:
+                self._send_response(404, 'application/json', '{"status": "error", "message": "Unknown job"}')
+            else:
+                self._send_response(200, 'application/json', json.dumps(job))
+        elif path == '/pin/low':
             self._handle_pin_low()
-        elif self.path == '/pin/high':
+        elif path == '/pin/high':
             self._handle_pin_high()
+        elif path == '/pin/abort':
+            self._handle_pin_high(abort=True)
+        elif path == '/pin/pulse':
+            self._handle_pin_timed(query, PIN_PULSE_MS, 'pulse')
+        elif path == '/pin/hold':
+            self._handle_pin_timed(query, PIN_HOLD_MS, 'hold')
         else:
             self._send_response(404, 'text/plain', 'Not Found')
 
+    def _route_post(self, path, query):
+        body = self._read_body()
+        if body is None:
+            return
+        if path == '/login':
+            form = parse_qs(body.decode('utf-8', 'replace'))
+            self._login(form.get('token', [''])[0].strip())
+        elif path == '/logout':
+            self._set_session('', 0)
+        elif path == '/jobs':
+            self._create_job(body)
+        else:
+            self._send_response(404, 'text/plain', 'Not Found')
+
+    def _route_delete(self, path, query):
+        if self._read_body() is None:
+            return
+        if path.startswith('/jobs/') and jobs.remove(path[len('/jobs/'):]):
+            self._send_response(200, 'application/json', '{"status": "ok"}')
+        else:
+            self._send_response(404, 'application/json', '{"status": "error", "message": "Unknown job"}')
+
+    def _read_body(self):
+        """The request body, or None after answering 413 when it is over 4 KiB.
+
+        Must be called for every request that may carry a body, whatever the
+        path, or the body would be read as the next request on the connection.
+        """
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= 4096:
+            self.close_connection = True
+            self._send_response(413, 'text/plain', 'Payload Too Large')
+            return None
+        return self.rfile.read(length)
+
+    def _create_job(self, body):
+        """Schedule a wake-up from a JSON job spec (see JobScheduler); answers 201 with the job."""
+        try:
+            job = jobs.create(json.loads(body or b'null'))
+        except ValueError as e:
+            self._send_response(400, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        except RuntimeError as e:
+            self._send_response(409, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        self._send_response(201, 'application/json', json.dumps(job), {'Location': f"/jobs/{job['id']}"})
+
+    def _authorize(self, path):
+        """Check the request's token against the scope path needs; if it falls short, answer 401/403."""
+        scope = _route_scope(path, self.command)
+        if not AUTH_SECRET or scope is None:
+            return True
+        header = self.headers.get('Authorization', '')
+        if header[:7].lower() == 'bearer ':
+            token = header[7:].strip()
+        else:
+            token = _cookie(self.headers.get('Cookie', ''), SESSION_COOKIE)
+        if not token:
+            metrics.inc('wol_auth_failures_total', reason='missing')
+            scopes = None
+        else:
+            scopes = auth.verify(token)
+        if scopes is None:
+            if path == '/':
+                page = render_login_page('Session expired' if token else '')
+                self._send_response(401, 'text/html; charset=utf-8', page)
+            else:
+                body = json.dumps({"status": "error", "message": "Authentication required"})
+                self._send_response(401, 'application/json', body, {'WWW-Authenticate': 'Bearer realm="wol"'})
+            return False
+        if scope not in scopes:
+            metrics.inc('wol_auth_failures_total', reason='scope')
+            body = json.dumps({"status": "error", "message": f"This token lacks the {scope} scope"})
+            challenge = f'Bearer realm="wol", error="insufficient_scope", scope="{scope}"'
+            self._send_response(403, 'application/json', body, {'WWW-Authenticate': challenge})
+            return False
+        return True
+
+    def _login(self, token):
+        """Turn a valid token into a session cookie and go to the dashboard."""
+        if not AUTH_SECRET:
+            self._set_session('', 0)
+            return
+        scopes = auth.verify(token) if token else None
+        if scopes is None:
+            self._send_response(401, 'text/html; charset=utf-8', render_login_page('Invalid or expired token'))
+            return
+        self._set_session(token, int(token.split('.')[1]) - int(time.time()))
+
+    def _set_session(self, token, max_age):
+        # SameSite=Strict keeps other sites from riding the session: every action here is a plain GET
+        cookie = f'{SESSION_COOKIE}={token}; Max-Age={max_age}; Path=/; HttpOnly; SameSite=Strict'
+        self.send_response(303)
+        self.send_header('Location', '/')
+        self.send_header('Set-Cookie', cookie)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _handle_device(self, path, query):
+        """Route /devices/<id> and its /ping, /wol and /wakes sub-resources."""
+        parts = path.rstrip('/').split('/')  # ['', 'devices', id, action?]
+        device = DEVICES.get(parts[2]) if len(parts) in (3, 4) else None
+        action = parts[3] if len(parts) == 4 else ''
+        if device is None or action not in ('', *DEVICE_ACTIONS):
+            self._send_response(404, 'application/json', json.dumps({"status": "error", "message": "Unknown device"}))
+        elif action == 'wol':
+            self._send_wol(device, query)
+        elif action == 'ping':
+            self._check_ping(device)
+        elif action == 'wakes':
+            self._send_response(200, 'application/json', json.dumps(wake_history.summary(device.id)))
+        else:
+            response = json.dumps({**device.to_dict(), **monitor.status(device.id)})
+            self._send_response(200, 'application/json', response)
+
     def _handle_pin_low(self):
         """Simulate button press by pulling pin LOW."""
-        global safety_timer
-        if not GPIO or not HW_PIN:
+        global pin_pressed, pin_pressed_at
+        if not gpio:
             self._send_response(400, 'application/json', '{"status": "error", "message": "GPIO missing"}')
             return
         
         try:
-            # Safe Open-Drain: Set to OUTPUT and force it LOW instantly
-            GPIO.setup(int(HW_PIN), GPIO.OUT, initial=GPIO.LOW)
-            
-            if safety_timer:
-                safety_timer.cancel()
-            safety_timer = threading.Timer(30.0, reset_pin_high)
-            safety_timer.start()
+            self._check_client_rate()
+            with gpio_lock:
+                if press_engine.busy:
+                    raise RuntimeError("A timed press is in progress")
+                # Holding the button down (repeated /pin/low while pressed) is not a new press
+                if not pin_pressed:
+                    device_limiter.check(('button',), 'device', "The power button was pressed too recently")
+                gpio.press()
+
+                safety_timer.arm()
+                pin_pressed = True
+                if pin_pressed_at is None:
+                    pin_pressed_at = time.monotonic()
+            events.publish('pin', {'pressed': True, 'source': 'button'})
             self._send_response(200, 'application/json', '{"status": "ok"}')
+        except RateLimited as e:
+            self._send_rate_limited(e)
+        except RuntimeError as e:
+            self._send_response(409, 'application/json', json.dumps({"status": "error", "message": str(e)}))
         except Exception as e:
             self._send_response(500, 'application/json', f'{{"status": "error", "message": "{str(e)}"}}')
 
-    def _handle_pin_high(self):
-        """Simulate button release by setting pin to INPUT (high impedance)."""
-        global safety_timer
-        if not GPIO or not HW_PIN:
+    def _handle_pin_high(self, abort=False):
+        """Simulate button release by setting pin to INPUT (high impedance).
+
+        /pin/high only ends a manual /pin/low press, so a dashboard releasing its
+        button cannot cut a running pulse or hold short; /pin/abort ends either.
+        """
+        global pin_pressed
+        if not gpio:
             self._send_response(400, 'application/json', '{"status": "error", "message": "GPIO missing"}')
             return
             
         try:
-            # Set back to INPUT to release the circuit
-            GPIO.setup(int(HW_PIN), GPIO.IN)
-            
-            if safety_timer:
+            with gpio_lock:
+                if press_engine.busy and not abort:
+                    raise RuntimeError("A timed press is in progress; /pin/abort cancels it")
+                gpio.release()
+
                 safety_timer.cancel()
-                safety_timer = None
+                pin_pressed = False
+                _record_release()
+                if abort:
+                    press_engine.abort()
+            events.publish('pin', {'pressed': False, 'source': 'abort' if abort else 'button'})
             self._send_response(200, 'application/json', '{"status": "ok"}')
+        except RuntimeError as e:
+            self._send_response(409, 'application/json', json.dumps({"status": "error", "message": str(e)}))
         except Exception as e:
             self._send_response(500, 'application/json', f'{{"status": "error", "message": "{str(e)}"}}')
 
-    def _send_response(self, code, content_type, body):
+    def _handle_pin_timed(self, query, default_ms, source):
+        """Press the button for ?ms=<milliseconds>, timed server-side (/pin/pulse, /pin/hold)."""
+        if not gpio:
+            self._send_response(400, 'application/json', '{"status": "error", "message": "GPIO missing"}')
+            return
+        try:
+            ms = float(query['ms'][0]) if 'ms' in query else default_ms
+            if not 1 <= ms <= PIN_MAX_HOLD_MS:
+                raise ValueError(f"ms must be between 1 and {PIN_MAX_HOLD_MS}")
+        except ValueError as e:
+            self._send_response(400, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        def press():
+            device_limiter.check(('button',), 'device', "The power button was pressed too recently")
+            return press_engine.press_for(ms / 1000, source)
+
+        try:
+            self._check_client_rate()
+            # The same press requested again while it runs is joined, not refused as busy
+            result, shared = actions.do(('press', source, ms), press)
+        except RateLimited as e:
+            self._send_rate_limited(e)
+            return
+        except RuntimeError as e:
+            self._send_response(409, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        except Exception as e:
+            self._send_response(500, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        if shared:
+            result = {**result, "coalesced": True}
+        self._send_response(200, 'application/json', json.dumps({"status": "ok", **result}))
+
+    def _check_client_rate(self):
+        """Take a token from this client's bucket or raise RateLimited."""
+        client_limiter.check(self.client_address[0], 'client', "Too many actions, slow down")
+
+    def _send_rate_limited(self, error):
+        body = json.dumps({"status": "error", "message": str(error), "retry_after": round(error.retry_after, 3)})
+        self._send_response(429, 'application/json', body, {'Retry-After': str(math.ceil(error.retry_after))})
+
+    def _send_history(self, query):
+        """Recorded events and uptime buckets: ?since=24h&until=<time>&device=<id>&points=100."""
+        now = time.time()
+        device_id = query.get('device', [None])[0]
+        if device_id is not None and device_id not in DEVICES:
+            self._send_response(404, 'application/json', json.dumps({"status": "error", "message": "Unknown device"}))
+            return
+        try:
+            since = parse_time(query.get('since', ['24h'])[0], now)
+            until = parse_time(query['until'][0], now) if 'until' in query else now
+            points = int(query.get('points', ['100'])[0])
+            if not since < until:
+                raise ValueError("since must be before until")
+            if not 1 <= points <= HISTORY_MAX_POINTS:
+                raise ValueError(f"points must be between 1 and {HISTORY_MAX_POINTS}")
+        except ValueError as e:
+            self._send_response(400, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        self._send_response(200, 'application/json', json.dumps(history.query(since, until, device_id, points)))
+
+    def _send_response(self, code, content_type, body, headers=None):
+        body = body.encode('utf-8')
         self.send_response(code)
         self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
         self.send_header('Cache-Control', 'no-cache')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(body.encode('utf-8'))
+        self.wfile.write(body)
 
-    def _serve_html(self, html_content):
-        self._send_response(200, 'text/html; charset=utf-8', html_content)
-
-    def _send_wol(self):
+    def _send_wol(self, device, query):
         try:
-            # Use the configured BROADCAST_IP
-            send_magic_packet(TARGET_MAC, ip_address=BROADCAST_IP)
-            response = json.dumps({"status": "ok", "message": "Magic Packet sent successfully."})
-            self._send_response(200, 'application/json', response)
+            key, action = plan_wol(device, query)
+        except ValueError as e:
+            self._send_response(400, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        try:
+            self._check_client_rate()
+            if float(query.get('wait', ['0'])[0]) and hasattr(self.server, 'detach'):
+                # A wait can last WAKE_MAX_WAIT seconds; don't hold a pool worker for it
+                self.server.detach()
+            result, shared = actions.do(key, action)
+        except RateLimited as e:
+            self._send_rate_limited(e)
+            return
         except Exception as e:
-            response = json.dumps({"status": "error", "message": str(e)})
-            self._send_response(500, 'application/json', response)
+            self._send_response(500, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        if shared:
+            result = {**result, "coalesced": True}
+        self._send_response(200, 'application/json', json.dumps(result))
 
-    def _check_ping(self):
+    def _send_wol_bulk(self, query):
+        """Wake several devices: /wol/bulk?ids=a,b,c (or ids=all)."""
         try:
-            param = '-n' if sys.platform == 'win32' else '-c'
-            # Ping with a 1-second timeout
-            command = ['ping', param, '1', '-W', '1', TARGET_IP]
-            is_alive = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
-        except Exception:
-            is_alive = False
-        response = json.dumps({'alive': is_alive})
+            key, action = plan_wol_bulk(query)
+        except ValueError as e:
+            self._send_response(400, 'application/json', json.dumps({"status": "error", "message": str(e)}))
+            return
+        try:
+            self._check_client_rate()
+            body, shared = actions.do(key, action)
+        except RateLimited as e:
+            self._send_rate_limited(e)
+            return
+        if shared:
+            body = {**body, "coalesced": True}
+        self._send_response(500 if body["failed"] else 200, 'application/json', json.dumps(body))
+
+    def _list_devices(self):
+        devices = [{**device.to_dict(), **monitor.status(device.id)} for device in DEVICES.values()]
+        self._send_response(200, 'application/json', json.dumps({"devices": devices}))
+
+    def _check_ping(self, device):
+        # Served from the background monitor's cache; only the very first request
+        # after startup may wait briefly for the initial probe to complete.
+        response = json.dumps(monitor.status(device.id, wait=1.5))
         self._send_response(200, 'application/json', response)
 
-    def _serve_favicon(self):
+    def _stream_events(self):
+        """Server-Sent Events stream: current state first, then every change as it happens."""
+        subscriber = events.subscribe()
+        if subscriber is None:
+            self._send_response(503, 'application/json', '{"status": "error", "message": "Too many event streams"}')
+            return
+        # The stream may stay open for hours: give this worker's place back to the pool
+        if hasattr(self.server, 'detach'):
+            self.server.detach()
+        # KEEPALIVE_TIMEOUT is for idle requests; a client that takes no write for several keepalives is gone
+        self.connection.settimeout(EVENT_KEEPALIVE * 4)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            # Browsers reconnect on their own; ask them to wait 3s rather than hammering a restarting server
+            self.wfile.write(b'retry: 3000\n\n')
+            # Only the main card's device is sent up front; the fleet list loads /devices itself
+            self._write_event('status', json.dumps(monitor.status(primary_device().id, wait=1.5)))
+            self._write_event('pin', json.dumps({'pressed': pin_pressed, 'source': 'snapshot'}))
+            last_write = time.monotonic()
+            while True:
+                try:
+                    message = subscriber.get(timeout=1.0)
+                except queue.Empty:
+                    monitor.publish_staleness()
+                    if time.monotonic() - last_write >= EVENT_KEEPALIVE:
+                        # Comment line: keeps proxies from timing out an idle stream and detects gone clients
+                        self.wfile.write(b': keepalive\n\n')
+                        self.wfile.flush()
+                        last_write = time.monotonic()
+                    continue
+                if message is None:
+                    return
+                self._write_event(*message)
+                last_write = time.monotonic()
+        except OSError:
+            pass  # The client went away or stopped reading (the write timed out)
+        finally:
+            events.unsubscribe(subscriber)
+
+    def _write_event(self, event, data):
+        self.wfile.write(f'event: {event}\ndata: {data}\n\n'.encode('utf-8'))
+        self.wfile.flush()
+
+    def _serve_asset(self, asset):
+        """Serve a pre-rendered asset, honouring If-None-Match and Accept-Encoding."""
+        encoding, body, etag = asset.select(self.headers.get('Accept-Encoding', ''))
+        if etag in _parse_etags(self.headers.get('If-None-Match', '')):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', asset.cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
         self.send_response(200)
-        self.send_header('Content-Type', 'image/svg+xml')
+        self.send_header('Content-Type', asset.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', asset.cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
         self.end_headers()
-        self.wfile.write(FAVICON_DEFAULT_SVG)
-
-    def render_main_page(self) -> str:
-        # NOTE: All literal curly braces for CSS and JS have been doubled (e.g., {{, }})
-        # to work correctly inside the Python f-string.
-        # The variables {FRIENDLY_NAME}, {TARGET_IP}, {TARGET_MAC}, and {BROADCAST_IP}
-        # are injected directly into the HTML/JS.
-        return f'''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{FRIENDLY_NAME} - WOL Controller</title>
-    <link id="favicon" rel="icon" href="/favicon.svg" type="image/svg+xml">
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@400;600&display=swap" rel="stylesheet">
-    <style>
-        :root {{
-            --bg-color-light: #f4f7f9;
-            --card-bg-light: rgba(255, 255, 255, 0.7);
-            --text-color-light: #2c3e50;
-            --text-light-light: #7f8c8d;
-            --border-color-light: rgba(0, 0, 0, 0.05);
-            --shadow-color-light: rgba(0, 0, 0, 0.1);
-
-            --bg-color-dark: #1c1c1e;
-            --card-bg-dark: rgba(44, 44, 46, 0.7);
-            --text-color-dark: #e5e5e7;
-            --text-light-dark: #8e8e93;
-            --border-color-dark: rgba(255, 255, 255, 0.1);
-            --shadow-color-dark: rgba(0, 0, 0, 0.3);
-
-            --accent-color: #3498db;
-            --accent-hover: #2980b9;
-            --online-color: #2ecc71;
-            --offline-color: #e74c3c;
-            --font-family: 'Poppins', sans-serif;
-        }}
-
-        html[data-theme='light'] {{
-            --bg-color: var(--bg-color-light);
-            --card-bg: var(--card-bg-light);
-            --text-color: var(--text-color-light);
-            --text-light: var(--text-light-light);
-            --border-color: var(--border-color-light);
-            --shadow-color: var(--shadow-color-light);
-        }}
-        html[data-theme='dark'] {{
-            --bg-color: var(--bg-color-dark);
-            --card-bg: var(--card-bg-dark);
-            --text-color: var(--text-color-dark);
-            --text-light: var(--text-light-dark);
-            --border-color: var(--border-color-dark);
-            --shadow-color: var(--shadow-color-dark);
-        }}
-
-        * {{ box-sizing: border-box; margin: 0; padding: 0; }}
-
-        @keyframes gradient-animation {{
-            0% {{ background-position: 0% 50%; }}
-            50% {{ background-position: 100% 50%; }}
-            100% {{ background-position: 0% 50%; }}
-        }}
-
-        @keyframes fadeInUp {{
-            from {{ opacity: 0; transform: translate3d(0, 20px, 0); }}
-            to {{ opacity: 1; transform: translate3d(0, 0, 0); }}
-        }}
-
-        @keyframes pulse {{
-            0% {{ background-color: rgba(128, 128, 128, 0.1); }}
-            50% {{ background-color: rgba(128, 128, 128, 0.2); }}
-            100% {{ background-color: rgba(128, 128, 128, 0.1); }}
-        }}
-        
-        body {{
-            font-family: var(--font-family);
-            color: var(--text-color);
-            background: linear-gradient(-45deg, var(--bg-color), #eaeaea, var(--bg-color), #f1f1f1);
-            background-size: 400% 400%;
-            animation: gradient-animation 25s ease infinite;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            min-height: 100vh;
-            padding: 1rem;
-            transition: background-color 0.4s ease;
-        }}
-        html[data-theme='dark'] body {{
-             background: linear-gradient(-45deg, var(--bg-color), #2c2c2e, var(--bg-color), #101012);
-             background-size: 400% 400%;
-             animation: gradient-animation 25s ease infinite;
-        }}
-
-        .card {{
-            width: 100%;
-            max-width: 400px;
-            background-color: var(--card-bg);
-            backdrop-filter: blur(20px) saturate(180%);
-            -webkit-backdrop-filter: blur(20px) saturate(180%);
-            border-radius: 20px;
-            border: 1px solid var(--border-color);
-            border-top-width: 4px;
-            padding: 2rem;
-            text-align: center;
-            box-shadow: 0 8px 32px 0 var(--shadow-color);
-            transition: all 0.4s ease;
-            animation: fadeInUp 0.8s ease-out forwards;
-        }}
-        .card:hover {{
-            transform: translateY(-5px);
-            box-shadow: 0 12px 40px 0 var(--shadow-color);
-        }}
-        .card.online-border {{ border-top-color: var(--online-color); }}
-        .card.offline-border {{ border-top-color: var(--offline-color); }}
-        
-        .skeleton {{
-            animation: pulse 1.5s cubic-bezier(0.4, 0, 0.6, 1) infinite;
-            background-color: rgba(128,128,128,0.1);
-            color: transparent !important;
-            border-radius: 8px;
-        }}
-        .skeleton.skeleton-text {{ height: 1.2em; width: 80%; margin: 0.2em auto; }}
-        .skeleton.skeleton-title {{ height: 1.5em; width: 60%; margin: 0.2em auto 1rem; }}
-        .skeleton.skeleton-info {{ height: 4.5em; margin-bottom: 1.5rem; }}
-        .skeleton.skeleton-status {{ height: 3.2rem; border-radius: 50px; margin-bottom: 1.5rem; }}
-        .skeleton.skeleton-button {{ height: 3.5rem; border-radius: 12px; }}
-
-        h1 {{ font-weight: 600; font-size: 1.75rem; margin-bottom: 0.5rem; }}
-        .device-info {{ padding: 0.75rem 1rem; margin-bottom: 1.5rem; word-break: break-all; text-align: left; line-height: 1.6; }}
-        .device-info strong {{ color: var(--text-color); }}
-        .device-info span {{ color: var(--text-light); font-family: 'Menlo', 'Consolas', monospace; }}
-
-        .status {{ display: flex; align-items: center; justify-content: center; gap: 0.75rem; padding: 0.75rem; border-radius: 50px; margin-top: 1rem; margin-bottom: 1.5rem; font-weight: 600; font-size: 1.1rem; transition: all 0.3s ease; }}
-        .status.online {{ background-color: rgba(46, 204, 113, 0.15); color: var(--online-color); }}
-        .status.offline {{ background-color: rgba(231, 76, 60, 0.15); color: var(--offline-color); }}
-        .status svg {{ width: 24px; height: 24px; }}
-        
-        #wol-button {{ width: 100%; display: flex; align-items: center; justify-content: center; gap: 0.75rem; padding: 1rem; font-size: 1rem; font-weight: 600; font-family: var(--font-family); color: #fff; background-color: var(--accent-color); border: none; border-radius: 12px; cursor: pointer; transition: all 0.3s ease; }}
-        #wol-button:hover:not(:disabled) {{ background-color: var(--accent-hover); }}
-        #wol-button:disabled {{ cursor: not-allowed; background-color: var(--text-light); opacity: 0.7; }}
-
-        #hw-button {{
-            width: 100%; display: flex; align-items: center; justify-content: center; gap: 0.75rem; 
-            padding: 1rem; font-size: 1rem; font-weight: 600; font-family: var(--font-family); 
-            color: #fff; background-color: #e67e22; border: none; border-radius: 12px; 
-            cursor: pointer; transition: all 0.1s ease; margin-top: 1rem;
-            box-shadow: 0 6px 0 #d35400, 0 8px 10px rgba(0,0,0,0.2); /* 3D effect for physical push */
-        }}
-
-        #hw-button:hover:not(:disabled) {{ background-color: #d35400; }}
-        #hw-button:active {{
-            transform: translateY(6px);
-            box-shadow: 0 0px 0 #d35400, 0 2px 4px rgba(0,0,0,0.2);
-        }}
-        
-        #toast {{ visibility: hidden; min-width: 250px; background-color: #333; color: #fff; text-align: center; border-radius: 12px; padding: 16px; position: fixed; z-index: 1; left: 50%; transform: translateX(-50%); bottom: 30px; font-size: 1rem; }}
-        #toast.show {{ visibility: visible; animation: toast-fadein 0.5s, toast-fadeout 0.5s 2.5s; }}
-        @keyframes toast-fadein {{ from {{ bottom: 0; opacity: 0; }} to {{ bottom: 30px; opacity: 1; }} }}
-        @keyframes toast-fadeout {{ from {{ bottom: 30px; opacity: 1; }} to {{ bottom: 0; opacity: 0; }} }}
-
-        #theme-switcher {{ position: fixed; top: 20px; right: 20px; background: var(--card-bg); border: 1px solid var(--border-color); border-radius: 50%; width: 40px; height: 40px; cursor: pointer; display: flex; justify-content: center; align-items: center; }}
-        #theme-switcher svg {{ width: 20px; height: 20px; color: var(--text-color); }}
-        .icon-sun, .icon-moon {{ display: none; }}
-        html[data-theme='light'] .icon-moon {{ display: block; }}
-        html[data-theme='dark'] .icon-sun {{ display: block; }}
-    </style>
-</head>
-<body>
-    <div class="card" id="main-card">
-        <h1 id="card-title" class="skeleton skeleton-title"></h1>
-        <div id="device-info" class="skeleton skeleton-info"></div>
-        <div id="status-indicator" class="skeleton skeleton-status"></div>
-        <div id="wol-button-container" class="skeleton skeleton-button">
-            <button id="wol-button" style="display: none;"></button>
-        </div>
-        <button id="hw-button" style="display: none;">
-            <svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M18.36 6.64a9 9 0 1 1-12.73 0"/><line x1="12" y1="2" x2="12" y2="12"/></svg>
-            <span>HW Power Button</span>
-        </button>
-    </div>
-    
-    <div id="toast"></div>
-
-    <button id="theme-switcher" title="Toggle Theme">
-        <svg class="icon-sun" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M12 3v1m0 16v1m9-9h-1M4 12H3m15.364 6.364l-.707.707M6.343 6.343l-.707-.707m12.728 0l-.707-.707M6.343 17.657l-.707.707M12 12a5 5 0 100-10 5 5 0 000 10z"></path></svg>
-        <svg class="icon-moon" fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M20.354 15.354A9 9 0 018.646 3.646 9.003 9.003 0 0012 21a9.003 9.003 0 008.354-5.646z"></path></svg>
-    </button>
-    
-    <script>
-        // --- DOM Elements ---
-        const mainCard = document.getElementById('main-card');
-        const cardTitle = document.getElementById('card-title');
-        const deviceInfo = document.getElementById('device-info');
-        const statusIndicator = document.getElementById('status-indicator');
-        const wolButtonContainer = document.getElementById('wol-button-container');
-        const wolButton = document.getElementById('wol-button');
-        const hwButton = document.getElementById('hw-button');
-        const themeSwitcher = document.getElementById('theme-switcher');
-        const favicon = document.getElementById('favicon');
-
-        // --- State ---
-        let isInitialLoad = true;
-        let pingInterval;
-
-        // --- Icons ---
-        const ICONS = {{
-            online: '<svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M20 6 9 17l-5-5"/></svg>',
-            offline: '<svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M18 6 6 18"/><path d="m6 6 12 12"/></svg>',
-            wakeUp: '<svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"><path d="M12 2c-5.52 0-10 4.48-10 10s4.48 10 10 10 10-4.48 10-10S17.52 2 12 2Z"/><path d="M12 12v5"/><path d="M12 7v1"/></svg>',
-        }};
-        const FAVICONS = {{
-            online: "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' xml:space='preserve' id='svg10' x='0' y='0' version='1.1' viewBox='0 0 64 64'%3E%3Cstyle id='style1' type='text/css'%3E.st1%7Bopacity:.2%7D.st2%7Bfill:%23231f20%7D.st3%7Bfill:%23fff%7D%3C/style%3E%3Cg id='Layer_1'%3E%3Cg id='g1'%3E%3Ccircle id='circle1' cx='32' cy='32' r='32' fill='%232ecc71' fill-opacity='1'/%3E%3C/g%3E%3Cg id='g2' class='st1'%3E%3Cpath id='path1' d='M44 52a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st2'/%3E%3C/g%3E%3Cg id='g3'%3E%3Cpath id='path2' d='M44 50a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st3'/%3E%3C/g%3E%3Cg id='g4'%3E%3Cpath id='path3' fill='%23e0e0d1' d='M37 42s-1 6 3 6H24c4 0 3-6 3-6h10z'/%3E%3C/g%3E%3Cg id='g6' class='st1'%3E%3Cg id='g5'%3E%3Cpath id='path4' d='M52 40a4 4 0 0 1-4 4H16a4 4 0 0 1-4-4V18a4 4 0 0 1 4-4h32a4 4 0 0 1 4 4v22z' class='st2'/%3E%3C/g%3E%3C/g%3E%3Cg id='g9'%3E%3Cg id='g7'%3E%3Cpath id='path6' fill='%234f5d73' d='M16 40.5a2.5 2.5 0 0 1-2.5-2.5V16c0-1.4 1.1-2.5 2.5-2.5h32c1.4 0 2.5 1.1 2.5 2.5v22c0 1.4-1.1 2.5-2.5 2.5H16z'/%3E%3C/g%3E%3Cg id='g8'%3E%3Cpath id='path7' d='M48 15c.6 0 1 .4 1 1v22c0 .6-.4 1-1 1H16c-.6 0-1-.4-1-1V16c0-.6.4-1 1-1h32m0-3H16a4 4 0 0 0-4 4v22a4 4 0 0 0 4 4h32a4 4 0 0 0 4-4V16a4 4 0 0 0-4-4z' class='st3'/%3E%3C/g%3E%3C/g%3E%3Cg id='g10' class='st1'%3E%3Cpath id='polygon9' d='M50 39.9v-26H26.2l15 26z' class='st3'/%3E%3C/g%3E%3C/g%3E%3C/svg%3E",
-            offline: "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' xml:space='preserve' id='svg10' x='0' y='0' version='1.1' viewBox='0 0 64 64'%3E%3Cstyle id='style1' type='text/css'%3E.st1%7Bopacity:.2%7D.st2%7Bfill:%23231f20%7D.st3%7Bfill:%23fff%7D%3C/style%3E%3Cg id='Layer_1'%3E%3Cg id='g1'%3E%3Ccircle id='circle1' cx='32' cy='32' r='32' fill='%23ea4c3c' fill-opacity='1'/%3E%3C/g%3E%3Cg id='g2' class='st1'%3E%3Cpath id='path1' d='M44 52a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st2'/%3E%3C/g%3E%3Cg id='g3'%3E%3Cpath id='path2' d='M44 50a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st3'/%3E%3C/g%3E%3Cg id='g4'%3E%3Cpath id='path3' fill='%23e0e0d1' d='M37 42s-1 6 3 6H24c4 0 3-6 3-6h10z'/%3E%3C/g%3E%3Cg id='g6' class='st1'%3E%3Cg id='g5'%3E%3Cpath id='path4' d='M52 40a4 4 0 0 1-4 4H16a4 4 0 0 1-4-4V18a4 4 0 0 1 4-4h32a4 4 0 0 1 4 4v22z' class='st2'/%3E%3C/g%3E%3C/g%3E%3Cg id='g9'%3E%3Cg id='g7'%3E%3Cpath id='path6' fill='%234f5d73' d='M16 40.5a2.5 2.5 0 0 1-2.5-2.5V16c0-1.4 1.1-2.5 2.5-2.5h32c1.4 0 2.5 1.1 2.5 2.5v22c0 1.4-1.1 2.5-2.5 2.5H16z'/%3E%3C/g%3E%3Cg id='g8'%3E%3Cpath id='path7' d='M48 15c.6 0 1 .4 1 1v22c0 .6-.4 1-1 1H16c-.6 0-1-.4-1-1V16c0-.6.4-1 1-1h32m0-3H16a4 4 0 0 0-4 4v22a4 4 0 0 0 4 4h32a4 4 0 0 0 4-4V16a4 4 0 0 0-4-4z' class='st3'/%3E%3C/g%3E%3C/g%3E%3Cg id='g10' class='st1'%3E%3Cpath id='polygon9' d='M50 39.9v-26H26.2l15 26z' class='st3'/%3E%3C/g%3E%3C/g%3E%3C/svg%3E",
-            checking: "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' xml:space='preserve' id='svg10' x='0' y='0' version='1.1' viewBox='0 0 64 64'%3E%3Cstyle id='style1' type='text/css'%3E.st1%7Bopacity:.2%7D.st2%7Bfill:%23231f20%7D.st3%7Bfill:%23fff%7D%3C/style%3E%3Cg id='Layer_1'%3E%3Cg id='g1'%3E%3Ccircle id='circle1' cx='32' cy='32' r='32' fill='%23eaaf3c' fill-opacity='1'/%3E%3C/g%3E%3Cg id='g2' class='st1'%3E%3Cpath id='path1' d='M44 52a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st2'/%3E%3C/g%3E%3Cg id='g3'%3E%3Cpath id='path2' d='M44 50a2 2 0 0 1-2 2H22a2 2 0 0 1-2-2c0-1.1.9-2 2-2h20a2 2 0 0 1 2 2z' class='st3'/%3E%3C/g%3E%3Cg id='g4'%3E%3Cpath id='path3' fill='%23e0e0d1' d='M37 42s-1 6 3 6H24c4 0 3-6 3-6h10z'/%3E%3C/g%3E%3Cg id='g6' class='st1'%3E%3Cg id='g5'%3E%3Cpath id='path4' d='M52 40a4 4 0 0 1-4 4H16a4 4 0 0 1-4-4V18a4 4 0 0 1 4-4h32a4 4 0 0 1 4 4v22z' class='st2'/%3E%3C/g%3E%3C/g%3E%3Cg id='g9'%3E%3Cg id='g7'%3E%3Cpath id='path6' fill='%234f5d73' d='M16 40.5a2.5 2.5 0 0 1-2.5-2.5V16c0-1.4 1.1-2.5 2.5-2.5h32c1.4 0 2.5 1.1 2.5 2.5v22c0 1.4-1.1 2.5-2.5 2.5H16z'/%3E%3C/g%3E%3Cg id='g8'%3E%3Cpath id='path7' d='M48 15c.6 0 1 .4 1 1v22c0 .6-.4 1-1 1H16c-.6 0-1-.4-1-1V16c0-.6.4-1 1-1h32m0-3H16a4 4 0 0 0-4 4v22a4 4 0 0 0 4 4h32a4 4 0 0 0 4-4V16a4 4 0 0 0-4-4z' class='st3'/%3E%3C/g%3E%3C/g%3E%3Cg id='g10' class='st1'%3E%3Cpath id='polygon9' d='M50 39.9v-26H26.2l15 26z' class='st3'/%3E%3C/g%3E%3C/g%3E%3C/svg%3E",
-        }};
-        
-        // --- Functions ---
-        
-        function removeSkeletons() {{
-            cardTitle.classList.remove('skeleton', 'skeleton-title');
-            deviceInfo.classList.remove('skeleton', 'skeleton-info');
-            statusIndicator.classList.remove('skeleton', 'skeleton-status');
-            wolButtonContainer.classList.remove('skeleton', 'skeleton-button');
-            wolButton.style.display = 'flex';
-        }}
-
-        function setFavicon(status) {{
-            favicon.href = FAVICONS[status] || FAVICONS.checking;
-        }}
-        
-        async function checkStatus() {{
-            try {{
-                const response = await fetch('/ping');
-                const data = await response.json();
-                
-                if (isInitialLoad) {{
-                    removeSkeletons();
-                    isInitialLoad = false;
-                }}
-
-                if (data.alive) {{
-                    statusIndicator.className = 'status online';
-                    statusIndicator.innerHTML = `${{ICONS.online}} <span>Online</span>`;
-                    mainCard.classList.add('online-border');
-                    mainCard.classList.remove('offline-border');
-                    setFavicon('online');
-                }} else {{
-                    statusIndicator.className = 'status offline';
-                    statusIndicator.innerHTML = `${{ICONS.offline}} <span>Offline</span>`;
-                    mainCard.classList.add('offline-border');
-                    mainCard.classList.remove('online-border');
-                    setFavicon('offline');
-                }}
-            }} catch (error) {{
-                console.error("Ping failed:", error);
-                statusIndicator.className = 'status offline';
-                statusIndicator.innerHTML = `${{ICONS.offline}} <span>Status Unknown</span>`;
-                setFavicon('offline');
-            }}
-        }}
-
-        function showToast(message) {{
-            const toast = document.getElementById("toast");
-            toast.textContent = message;
-            toast.className = "show";
-            setTimeout(() => {{ toast.className = toast.className.replace("show", ""); }}, 3000);
-        }}
-
-        async function sendWol() {{
-            wolButton.disabled = true;
-            wolButton.innerHTML = `<span>Sending...</span>`;
-            
-            try {{
-                await fetch('/wol');
-                showToast("Magic Packet sent successfully ✔️");
-            }} catch (error) {{
-                console.error("WOL failed:", error);
-                showToast("Failed to send packet ❌");
-            }}
-            
-            // Re-enable button after a delay
-            setTimeout(() => {{
-                wolButton.disabled = false;
-                wolButton.innerHTML = `${{ICONS.wakeUp}} <span>Wake Up Device</span>`;
-            }}, 2000);
-            
-            // Trigger a status check sooner
-            setTimeout(checkStatus, 3000);
-        }}
-
-        // --- Theme Management ---
-        function applyTheme(theme) {{
-            document.documentElement.setAttribute('data-theme', theme);
-            localStorage.setItem('theme', theme);
-        }}
-
-        themeSwitcher.addEventListener('click', () => {{
-            const currentTheme = localStorage.getItem('theme') || 'light';
-            const newTheme = currentTheme === 'light' ? 'dark' : 'light';
-            applyTheme(newTheme);
-        }});
-
-        // --- Initial Load ---
-        document.addEventListener('DOMContentLoaded', () => {{
-            // Set initial theme
-            const savedTheme = localStorage.getItem('theme');
-            const prefersDark = window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches;
-            applyTheme(savedTheme || (prefersDark ? 'dark' : 'light'));
-
-            // Populate static content
-            // These values are injected by the Python f-string
-            cardTitle.textContent = "{FRIENDLY_NAME}";
-            deviceInfo.innerHTML = `<strong>IP:</strong> <span>{TARGET_IP}</span><br><strong>MAC:</strong> <span>{TARGET_MAC}</span><br><strong>Broadcast:</strong> <span>{BROADCAST_IP}</span>`;
-            wolButton.innerHTML = `${{ICONS.wakeUp}} <span>Wake Up Device</span>`;
-            
-            // Add listeners
-            wolButton.addEventListener('click', sendWol);
-            
-            // Start status polling
-            setFavicon('checking');
-            checkStatus(); // Initial check
-            pingInterval = setInterval(checkStatus, 5000); // Poll every 5 seconds
+        self.wfile.write(body)
 
-            const hwPin = "{HW_PIN}";
-            
-            if (hwPin !== "") {{
-                hwButton.style.display = 'flex';
-                
-                const pressPin = () => fetch('/pin/low').catch(err => console.error("Error setting pin LOW:", err));
-                const releasePin = () => fetch('/pin/high').catch(err => console.error("Error setting pin HIGH:", err));
-
-                // Mouse events for desktop
-                hwButton.addEventListener('mousedown', pressPin);
-                hwButton.addEventListener('mouseup', releasePin);
-                hwButton.addEventListener('mouseleave', releasePin); // Safety trigger if mouse leaves button
-
-                // Touch events for mobile
-                hwButton.addEventListener('touchstart', (e) => {{ e.preventDefault(); pressPin(); }});
-                hwButton.addEventListener('touchend', (e) => {{ e.preventDefault(); releasePin(); }});
-                hwButton.addEventListener('touchcancel', (e) => {{ e.preventDefault(); releasePin(); }});
-            }}
-
-        }});
-
-    </script>
-</body>
-</html>
-'''
-
-def run():
-    """Starts the HTTP server and initializes GPIO."""
-    
-    # Initialize GPIO safely for Bookworm
-    if HW_PIN and GPIO:
-        try:
-            GPIO.setwarnings(False)
-            GPIO.setmode(GPIO.BCM)
-            # Default state is INPUT (button released / High-Z)
-            GPIO.setup(int(HW_PIN), GPIO.IN)
-            print(f"📌 GPIO Pin {HW_PIN} initialized as open-drain (released).")
+def render_main_page() -> str:
+    """Fill the dashboard template (PAGE_FILE) with this server's settings."""
+    path = PAGE_FILE or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wol_page.html')
+    with open(path, encoding='utf-8') as f:
+        template = f.read()
+    # The primary device is injected into the JS as JSON ('</' escaped so a name
+    # cannot close the script tag); the rest of the fleet is fetched from /devices.
+    values = {
+        'TITLE': escape(FRIENDLY_NAME),
+        'PRIMARY': json.dumps(primary_device().to_dict()).replace('</', '<\\/'),
+        'HW_PIN': HW_PIN,
+    }
+    return re.sub(r'__(TITLE|PRIMARY|HW_PIN)__', lambda match: values[match.group(1)], template)
+
+# --- Pre-rendered static assets ---
+def _parse_etags(header):
+    """Split an If-None-Match header into its entity tags (weak tags compare equal)."""
+    return {tag.strip().removeprefix('W/') for tag in header.split(',') if tag.strip()}
+
+def _accepted_encodings(header):
+    """Return the content codings an Accept-Encoding header allows (q=0 excluded)."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding)
+    return accepted
+
+def _compress(body, encoding):
+    """Compress body with gzip or brotli; None if brotli (optional) is not installed."""
+    if encoding == 'gzip':
+        return gzip.compress(body, 9, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(body)
+
+class StaticAsset:
+    """A response body kept in memory together with its compressed variants.
+
+    Each variant carries its own ETag, so a client revalidating a gzip copy
+    never gets a 304 for a brotli one. Variants are compressed the first time
+    a client asks for them, which keeps compression off the startup path.
+    """
+
+    def __init__(self, body, content_type, cache_control='no-cache'):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self._lock = threading.Lock()
+        self._digest = hashlib.sha1(body).hexdigest()[:16]
+        self.variants = {None: (body, f'"{self._digest}"')}  # encoding -> (body, etag), or None if unhelpful
+
+    def _variant(self, encoding):
+        with self._lock:
+            if encoding not in self.variants:
+                body = self.variants[None][0]
+                data = _compress(body, encoding)
+                # Tiny bodies can grow when compressed; only keep variants that help
+                helpful = data is not None and len(data) < len(body)
+                self.variants[encoding] = (data, f'"{self._digest}-{encoding}"') if helpful else None
+            return self.variants[encoding]
+
+    def select(self, accept_encoding):
+        """Pick the best variant for the client. Returns (encoding, body, etag)."""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted:
+                variant = self._variant(encoding)
+                if variant:
+                    return (encoding, *variant)
+        return (None, *self.variants[None])
+
+STATIC_ASSETS = {}
+
+def build_static_assets():
+    """Render the page and favicons; they only change when the configuration does."""
+    global STATIC_ASSETS
+    # Favicons never change, so browsers may keep them for a day; the page is revalidated every time
+    assets = {
+        '/': StaticAsset(render_main_page().encode('utf-8'), 'text/html; charset=utf-8'),
+        '/favicon.svg': StaticAsset(FAVICON_DEFAULT_SVG, 'image/svg+xml', 'public, max-age=86400'),
+    }
+    for status, color in FAVICON_STATUS_COLORS.items():
+        svg = FAVICON_STATUS_TEMPLATE.replace('__COLOR__', color).encode('utf-8')
+        assets[f'/favicon-{status}.svg'] = StaticAsset(svg, 'image/svg+xml', 'public, max-age=86400')
+    STATIC_ASSETS = assets
+    return STATIC_ASSETS
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that hands each connection to a bounded pool of worker threads.
+
+    A slow client or handler only occupies its own worker instead of stalling
+    /wol and /pin/high for everyone else. Workers are daemon threads, like
+    ThreadingHTTPServer's, so a stuck client never blocks shutdown.
+
+    Accepting never blocks: up to max_workers connections may wait for a
+    worker, and any beyond that get an immediate 503. A handler that turns
+    into a long-lived stream calls detach() to leave the pool, so streams never
+    count against the workers.
+    """
+
+    def __init__(self, server_address, handler_class, max_workers=None, max_per_client=None):
+        super().__init__(server_address, handler_class)
+        max_workers = MAX_WORKERS if max_workers is None else max_workers
+        max_per_client = MAX_CONNECTIONS_PER_CLIENT if max_per_client is None else max_per_client
+        # One slot per connection being served or waiting; as many may wait as there are workers
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._max_workers = max_workers
+        self._detached = set()  # Threads that left the pool to serve a stream
+        self._serving = {}  # Worker thread -> client IP of the connection it serves
+        self._spawned = max_workers - 1  # Highest worker number so far
+        # Keep-alive lets one client pin several workers; cap how many it may hold
+        self.max_per_client = max_per_client
+        self._clients_lock = threading.Lock()
+        self._client_connections = {}  # client IP -> open connections
+        self._requests = queue.Queue()
+        self._workers = [
+            threading.Thread(target=self._worker, name=f'http-worker-{i}', daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        host = client_address[0]
+        with self._clients_lock:
+            open_connections = self._client_connections.get(host, 0)
+            if open_connections >= self.max_per_client:
+                metrics.inc('wol_http_rejected_connections_total', reason='client')
+                self._refuse(request, b'429 Too Many Requests', b'Too many connections from this address')
+                return
+            self._client_connections[host] = open_connections + 1
+        if not self._slots.acquire(blocking=False):
+            metrics.inc('wol_http_rejected_connections_total', reason='busy')
+            self._refuse(request, b'503 Service Unavailable', b'Server busy')
+            self._connection_closed(host)
+            return
+        self._requests.put((request, client_address))
+
+    @property
+    def backlogged(self):
+        """Whether connections are waiting for a worker."""
+        return not self._requests.empty()
+
+    def _refuse(self, request, status, message):
+        """Answer on the accepting thread and close; the response fits the socket buffer, so this never waits."""
+        body = b'{"status": "error", "message": "%s"}' % message
+        response = (b'HTTP/1.1 %s\r\nContent-Type: application/json\r\n' % status
+                    + b'Retry-After: 1\r\nConnection: close\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+        try:
+            request.setblocking(False)
+            request.send(response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def detach(self):
+        """Take the calling worker out of the pool for a long-lived stream.
+
+        A new worker takes its place; the calling thread exits once its
+        connection closes instead of serving another one. The connection no
+        longer counts against its client's MAX_CONNECTIONS_PER_CLIENT either,
+        so a few open dashboards cannot lock their address out.
+        """
+        thread = threading.current_thread()
+        with self._clients_lock:
+            if thread in self._detached:
+                return
+            self._detached.add(thread)
+            self._spawned += 1
+            name = f'http-worker-{self._spawned}'
+            host = self._serving.pop(thread, None)
+        if host is not None:
+            self._connection_closed(host)
+        threading.Thread(target=self._worker, name=name, daemon=True).start()
+        self._slots.release()
+
+    def _connection_closed(self, host):
+        with self._clients_lock:
+            remaining = self._client_connections.get(host, 1) - 1
+            if remaining:
+                self._client_connections[host] = remaining
+            else:
+                self._client_connections.pop(host, None)
+
+    def _worker(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            thread = threading.current_thread()
+            with self._clients_lock:
+                self._serving[thread] = client_address[0]
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._clients_lock:
+                    detached = thread in self._detached
+                    self._detached.discard(thread)
+                    self._serving.pop(thread, None)
+                if not detached:
+                    self._connection_closed(client_address[0])  # detach() already did
+            if detached:
+                return  # Its slot went to its replacement in detach()
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        for _ in range(self._max_workers):
+            self._requests.put(None)
+
+# --- Runtime configuration ---
+config_lock = threading.Lock()  # Serializes reloads
+
+def parse_settings(data):
+    """Validate a config mapping against DEFAULT_SETTINGS.
+
+    Returns the complete settings (defaults for every key the file leaves out).
+    Raises ValueError for unknown keys, values of the wrong type and numbers
+    outside SETTING_RANGES.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("the config must be a JSON object")
+    settings = dict(DEFAULT_SETTINGS)
+    for key, value in data.items():
+        name = str(key).upper()
+        if name not in DEFAULT_SETTINGS:
+            raise ValueError(f"unknown setting {key!r}")
+        default = DEFAULT_SETTINGS[name]
+        if isinstance(default, tuple) and isinstance(value, list):
+            value = tuple(value)
+        elif isinstance(default, float) and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        elif name == 'HW_PIN' and isinstance(value, int) and not isinstance(value, bool):
+            value = str(value)
+        if type(value) is not type(default):
+            raise ValueError(f"{name} must be of type {type(default).__name__}")
+        if name in SETTING_RANGES:
+            low, high = SETTING_RANGES[name]
+            for item in value if isinstance(value, tuple) else (value,):
+                # NaN fails every comparison, so it is caught here too
+                if (type(item) not in (int, float) or not low <= item or (high is not None and item > high)
+                        or not math.isfinite(item)):
+                    limit = f"between {low} and {high}" if high is not None else f"at least {low}"
+                    raise ValueError(f"{name} must be {limit}, not {item!r}")
+        settings[name] = value
+    if not MAC_PATTERN.match(settings['TARGET_MAC']):
+        raise ValueError(f"TARGET_MAC is not a valid MAC address: {settings['TARGET_MAC']!r}")
+    if settings['GPIO_BACKEND'] not in ('auto', *GPIO_BACKENDS):
+        raise ValueError(f"GPIO_BACKEND must be one of auto, {', '.join(GPIO_BACKENDS)}")
+    if list(settings['METRICS_LATENCY_BUCKETS']) != sorted(set(settings['METRICS_LATENCY_BUCKETS'])):
+        raise ValueError("METRICS_LATENCY_BUCKETS must be in increasing order")
+    return settings
+
+def read_config(path):
+    """Read and validate the config file. Raises OSError or ValueError."""
+    with open(path) as f:
+        return parse_settings(json.load(f))
+
+def apply_settings(settings, live=True):
+    """Switch to new settings in one step and re-initialize only what they affect.
+
+    With live=False (startup) nothing is running yet, so only the values are set;
+    run() then calls configure_components() once for everything.
+    If the device registry they describe is invalid, the old settings are
+    restored and ValueError is raised. Returns the names of the changed settings.
+    """
+    global gpio, pin_pressed
+    with config_lock:
+        current = globals()
+        changed = {name: value for name, value in settings.items() if current[name] != value}
+        if not changed:
+            return set()
+        previous = {name: current[name] for name in changed}
+        # Handlers read these globals one at a time without a lock, so a request running
+        # across the update may combine old and new values; each value is valid on its own
+        current.update(changed)
+        if not live:
+            return set(changed)
+        try:
+            if changed.keys() & {'TARGET_MAC', 'TARGET_IP', 'BROADCAST_IP', 'FRIENDLY_NAME', 'TARGET_ID', 'DEVICES_FILE'}:
+                load_devices()
+        except (OSError, ValueError) as e:
+            current.update(previous)
+            raise ValueError(f"device registry: {e}") from e
+        # The page embeds the name, pin and primary device; rebuilding it is cheap
+        build_static_assets()
+        if changed.keys() & {'HW_PIN', 'GPIO_BACKEND', 'GPIO_CHIP'}:
+            with gpio_lock:
+                if gpio:
+                    gpio.close()  # Releases the line first
+                safety_timer.cancel()
+                pin_pressed = False
+                try:
+                    gpio = open_gpio_backend()
+                except Exception as e:
+                    gpio = None
+                    print(f"❌ Failed to setup GPIO pin {HW_PIN}. Error: {e}")
+            if gpio:
+                press_engine.start()
+        configure_components(changed)
+        return set(changed)
+
+def configure_components(changed=None):
+    """Hand the current settings to the objects built at import time.
+
+    changed names the settings that just changed on a live reload. None means
+    startup: nothing runs yet, so everything is applied, including the sizes
+    and files that otherwise need a restart.
+    """
+    global history, wake_history
+    startup = changed is None
+    monitor.interval, monitor.stale_after = PING_INTERVAL, PING_STALE_AFTER
+    events.max_clients = MAX_EVENT_CLIENTS
+    wol_sender.port = WOL_PORT
+    safety_timer.delay = PIN_SAFETY_TIMEOUT
+    client_limiter.rate, client_limiter.burst = ACTION_RATE, ACTION_BURST
+    device_limiter.rate, device_limiter.burst = DEVICE_RATE, DEVICE_BURST
+    RequestHandler.timeout = KEEPALIVE_TIMEOUT
+    auth.cache_size = AUTH_CACHE_SIZE
+    if startup or 'AUTH_SECRET' in changed:
+        auth.clear()  # Tokens signed with the old secret are dead; free their cache entries
+    if startup:
+        if history.size != HISTORY_SIZE:
+            history = HistoryStore(HISTORY_FILE, HISTORY_SIZE)
+        if wake_history.size != WAKE_HISTORY_SIZE:
+            wake_history = WakeHistory(WAKE_HISTORY_SIZE)
+        for name in ('wol_http_request_duration_seconds', 'wol_probe_rtt_seconds', 'wol_wol_batch_duration_seconds'):
+            metrics.set_buckets(name, METRICS_LATENCY_BUCKETS)
+        history.path = HISTORY_FILE
+        jobs.path = JOBS_FILE
+    elif 'HISTORY_FILE' in changed:
+        history.flush()
+        history.path = HISTORY_FILE
+
+def reload_config(path):
+    """Re-read the config file and apply it; a broken file leaves the running settings alone."""
+    try:
+        changed = apply_settings(read_config(path))
+    except (OSError, ValueError) as e:
+        print(f"❌ Config {path} not applied: {e}")
+        return
+    if changed:
+        print(f"🔄 Config reloaded: {', '.join(sorted(changed))}")
+        restart = changed & RESTART_SETTINGS
+        if restart:
+            print(f"⚠️ Restart the server to apply {', '.join(sorted(restart))}.")
+
+class ConfigWatcher:
+    """Calls reload_config() whenever the config file changes.
+
+    Watches the file's directory with inotify (through ctypes, so there is
+    nothing to install) since editors usually replace the file rather than
+    write it in place. Where inotify is unavailable it polls the file's mtime.
+    """
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=CONFIG_POLL_INTERVAL + 1)
+
+    def _open_inotify(self):
+        """Return an inotify descriptor watching the config directory, or None."""
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _loop(self):
+        fd = self._open_inotify()
+        if fd is None:
+            self._poll()
+            return
+        name = os.path.basename(self.path).encode()
+        try:
+            while not self._stop.is_set():
+                if not select.select([fd], [], [], 1.0)[0]:
+                    continue
+                data = os.read(fd, 4096)
+                touched = False
+                offset = 0
+                while offset + 16 <= len(data):
+                    _, _, _, length = struct.unpack_from('iIII', data, offset)
+                    touched |= data[offset + 16:offset + 16 + length].rstrip(b'\0') == name
+                    offset += 16 + length
+                if touched:
+                    # Let a burst of writes (truncate, write, close) settle into one reload
+                    self._stop.wait(0.2)
+                    reload_config(self.path)
+        finally:
+            os.close(fd)
+
+    def _poll(self):
+        def signature():
+            try:
+                stat = os.stat(self.path)
+                return stat.st_mtime_ns, stat.st_size
+            except OSError:
+                return None
+        last = signature()
+        while not self._stop.wait(CONFIG_POLL_INTERVAL):
+            current = signature()
+            if current != last:
+                last = current
+                reload_config(self.path)
+
+def _process_age():
+    """Seconds since this process was started (Linux), or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22, counted after the parenthesised command name, which may contain spaces
+            started_ticks = int(f.read().rpartition(')')[2].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _startup_report(checkpoints, port):
+    """Time the first request against the freshly started server and describe the startup as a dict."""
+    import http.client
+    import resource
+    started = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('GET', '/')
+    connection.getresponse().read()
+    connection.close()
+    first_request = time.perf_counter() - started
+    age = _process_age()
+    phases = {name: round((end - begin) * 1000, 3)
+              for (_, begin), (name, end) in zip(checkpoints, checkpoints[1:])}
+    return {
+        # Interpreter start-up plus importing this module, up to the call to run()
+        'process_start_to_run_ms': None if age is None else round((age - (time.perf_counter() - checkpoints[0][1])) * 1000, 1),
+        'phases_ms': phases,
+        'run_to_listening_ms': round((checkpoints[-1][1] - checkpoints[0][1]) * 1000, 3),
+        'first_request_ms': round(first_request * 1000, 3),
+        'modules_loaded': len(sys.modules),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def run(config=None, profile=False):
+    """Starts the HTTP server and initializes GPIO.
+
+    config is the path of a JSON settings file, watched for changes while the
+    server runs. With profile, the server starts on a spare local port, answers
+    one request, prints how long each startup step took (plus peak RSS) as JSON
+    and exits. For per-module import costs, run with python -X importtime.
+    """
+    global gpio
+    checkpoints = [('start', time.perf_counter())]
+
+    watcher = None
+    if config:
+        try:
+            apply_settings(read_config(config), live=False)
+        except (OSError, ValueError) as e:
+            print(f"❌ Could not load config {config}. Error: {e}")
+            return
+        watcher = ConfigWatcher(config)
+    configure_components()
+    checkpoints.append(('config', time.perf_counter()))
+
+    try:
+        load_devices()
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not load device registry {DEVICES_FILE}. Error: {e}")
+        return
+    checkpoints.append(('devices', time.perf_counter()))
+
+    try:
+        build_static_assets()
+    except OSError as e:
+        print(f"❌ Could not load the page template. Error: {e}")
+        return
+    checkpoints.append(('static_assets', time.perf_counter()))
+
+    # Claim the button line once; it starts released (high impedance). Without HW_PIN no GPIO library is imported.
+    if HW_PIN and gpio is None:
+        try:
+            gpio = open_gpio_backend()
+            print(f"📌 GPIO Pin {HW_PIN} initialized as open-drain (released) via {gpio.name}.")
         except Exception as e:
             print(f"❌ Failed to setup GPIO pin {HW_PIN}. Error: {e}")
-            
+
+    if gpio:
+        press_engine.start()
+    checkpoints.append(('gpio', time.perf_counter()))
+    history.start()
+    checkpoints.append(('history', time.perf_counter()))
+    jobs.start()
+    checkpoints.append(('jobs', time.perf_counter()))
+    monitor.start()
+    print(f"📡 Monitoring {len(DEVICES)} device(s) every {PING_INTERVAL:g}s.")
+    if watcher:
+        watcher.start()
+    checkpoints.append(('monitor', time.perf_counter()))
+
     try:
-        server_address = ('', PORT)
-        httpd = HTTPServer(server_address, RequestHandler)
-        print(f"✅ Server for '{FRIENDLY_NAME}' running on http://localhost:{PORT}")
+        server_address = ('127.0.0.1', 0) if profile else ('', PORT)
+        httpd = PooledHTTPServer(server_address, RequestHandler)
+        checkpoints.append(('listen', time.perf_counter()))
+        if profile:
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            print(json.dumps(_startup_report(checkpoints, httpd.server_address[1]), indent=2))
+            httpd.shutdown()
+            httpd.server_close()
+            return
+        print(f"✅ Server for '{FRIENDLY_NAME}' running on http://localhost:{PORT} ({MAX_WORKERS} workers)")
         print("Press Ctrl+C to stop.")
         httpd.serve_forever()
     except OSError as e:
@@ -510,11 +3259,35 @@ def run():
         print("\nStopping server...")
         httpd.server_close()
     finally:
+        if watcher:
+            watcher.stop()
+        monitor.stop()
+        jobs.stop()
+        history.stop()
+        wol_sender.close()
         # Ensure GPIO is cleaned up and left in a safe state when the script exits
-        if HW_PIN and GPIO:
-            GPIO.setup(int(HW_PIN), GPIO.IN) # Redundant safety
-            GPIO.cleanup()
+        if gpio:
+            gpio.close()  # Releases the line first
+            gpio = None
             print("🧹 GPIO cleaned up.")
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Wake-on-LAN HTTP server')
+    parser.add_argument('--config', help='JSON settings file, reloaded whenever it changes')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='start, serve one request, print startup timings as JSON and exit')
+    parser.add_argument('--issue-token', metavar='SCOPES',
+                        help=f"print a token for AUTH_SECRET granting comma-separated scopes ({', '.join(AUTH_SCOPES)}) and exit")
+    parser.add_argument('--token-days', type=float, help='token lifetime in days (default: AUTH_TOKEN_DAYS)')
+    args = parser.parse_args()
+    if args.issue_token:
+        try:
+            if args.config:
+                apply_settings(read_config(args.config), live=False)
+            days = AUTH_TOKEN_DAYS if args.token_days is None else args.token_days
+            print(auth.issue(args.issue_token.split(','), days * 86400))
+        except (OSError, ValueError) as e:
+            sys.exit(f"❌ Could not issue a token. Error: {e}")
+    else:
+        run(config=args.config, profile=args.profile_startup)